@@ -10,6 +10,10 @@ from yaml import load as yload
 
 from api_li3ds.app import api, init_apis
 from api_li3ds.database import Database
+from api_li3ds.metrics import metrics
+from api_li3ds.slowlog import slowlog
+from api_li3ds.changes import changes
+from api_li3ds.compression import compression
 
 __version__ = '0.1.dev0'
 
@@ -72,4 +76,8 @@ def create_app():
     init_apis()
     api.init_app(app)
     Database.init_app(app)
+    metrics.init_app(app)
+    slowlog.init_app(app)
+    changes.init_app(app)
+    compression.init_app(app)
     return app
@@ -1,8 +1,14 @@
 # -*- coding: utf-8 -*-
 from flask_restplus import fields
 
-from api_li3ds.app import api, Resource, defaultpayload
+from api_li3ds.app import (
+    api, Resource, defaultpayload, paginate, collection_params, object_params, select_list,
+    bulk_payload, after_write, by_ids, ids_model
+)
 from api_li3ds.database import Database
+from api_li3ds.expand import relation, expanded, expand_params
+from .itowns import calibrations
+from .referential import referential_model
 
 
 nsds = api.namespace('datasources', description='datasources related operations')
@@ -18,6 +24,10 @@ datasource_model = nsds.inherit('Datasource Model', datasource_model_post, {
     'id': fields.Integer,
 })
 
+relation('datasource', 'referential', 'referential', referential_model,
+         '{child}.id = {parent}.referential')
+relation('datasource', 'session', 'session', 'Session Model', '{child}.id = {parent}.session')
+
 processing_model_post = nsds.model('Processing Model Post', {
     'launched': fields.DateTime(dt_format='iso8601', default=None),
     'tool': fields.String(required=True),
@@ -34,15 +44,21 @@ processing_model = nsds.inherit('Processing Model', processing_model_post, {
 @nsds.route('/', endpoint='datasources')
 class Datasources(Resource):
 
+    tables = ('datasource',)
+
     @nsds.marshal_with(datasource_model)
+    @nsds.doc(params=collection_params)
     def get(self):
         '''Get all datasources'''
-        return Database.query_asjson("select * from li3ds.datasource")
+        return paginate(
+            "select {} from li3ds.datasource"
+            .format(select_list(datasource_model)), datasource_model)
 
     @api.secure
     @nsds.expect(datasource_model_post)
     @nsds.marshal_with(datasource_model)
     @nsds.response(201, 'Datasource created')
+    @after_write(calibrations.invalidate)
     def post(self):
         '''Create a datasource'''
         return Database.query_asdict(
@@ -53,15 +69,54 @@ class Datasources(Resource):
         ), 201
 
 
+@nsds.route('/lookup/', endpoint='datasources_lookup')
+class LookupDatasources(Resource):
+
+    @nsds.expect(ids_model)
+    @nsds.marshal_with(datasource_model, as_list=True)
+    @nsds.response(413, 'Too many identifiers')
+    def post(self):
+        '''Get datasources given their identifiers, in the same order.
+        Same as the ids parameter, for long lists
+        '''
+        return by_ids("select * from li3ds.datasource", api.payload['ids'])
+
+
+@nsds.route('/bulk/', endpoint='datasources_bulk')
+class BulkDatasources(Resource):
+
+    tables = ('datasource',)
+
+    @api.secure
+    @nsds.expect(([datasource_model_post], 'json array or newline delimited json'))
+    @nsds.response(201, 'Datasources created')
+    @after_write(calibrations.invalidate)
+    def post(self):
+        '''Create datasources in a single transaction, returns their identifiers'''
+        return Database.insert_many(
+            "insert into li3ds.datasource (referential, session, uri) "
+            "values {} returning id",
+            "(%(referential)s, %(session)s, %(uri)s)",
+            bulk_payload(datasource_model_post)
+        ), 201
+
+
 @nsds.route('/<int:id>/', endpoint='datasource')
 @nsds.response(404, 'Datasource not found')
 class OneDatasource(Resource):
 
+    tables = ('datasource',)
+
     @nsds.marshal_with(datasource_model)
+    @nsds.doc(params=dict(object_params, **expand_params('datasource')))
     def get(self, id):
         '''Get one datasource given its identifier'''
+        res = expanded('datasource', datasource_model, 't.id = %s', (id,), 'Datasource not found')
+        if res is not None:
+            return res
         res = Database.query_asjson(
-            "select * from li3ds.datasource where id=%s", (id,)
+            "select {} from li3ds.datasource where id=%s"
+            .format(select_list(datasource_model)), (id,)
         )
         if not res:
             nsds.abort(404, 'Datasource not found')
@@ -69,6 +124,7 @@ class OneDatasource(Resource):
 
     @api.secure
     @nsds.response(410, 'Datasource deleted')
+    @after_write(calibrations.invalidate)
     def delete(self, id):
         '''Delete a datasource given its identifier'''
         res = Database.rowcount("delete from li3ds.datasource where id=%s", (id,))
@@ -82,18 +138,22 @@ class OneDatasource(Resource):
 @nsds.response(404, 'Datasource not found')
 class Processing(Resource):
 
+    tables = ('datasource', 'processing')
+
     @nsds.marshal_with(processing_model)
+    @nsds.doc(params=object_params)
     def get(self, id):
         '''Get the processing tool used to generate this datasource'''
         res = Database.query_asjson(
-            "select * from li3ds.datasource where id=%s", (id,)
+            "select id from li3ds.datasource where id=%s", (id,)
         )
         if not res:
             nsds.abort(404, 'Datasource not found')
 
         return Database.query_asjson(
-            " select p.* from li3ds.processing p"
-            " join li3ds.datasource s on s.id = p.target where s.id=%s",
+            " select {} from li3ds.processing p"
+            " join li3ds.datasource s on s.id = p.target where s.id=%s"
+            .format(select_list(processing_model, 'p')),
             (id,)
         )
 
@@ -116,11 +176,15 @@ class Processing(Resource):
 @nsds.response(404, 'Processing not found')
 class OneProcessing(Resource):
 
+    tables = ('processing',)
+
     @nsds.marshal_with(processing_model)
+    @nsds.doc(params=object_params)
     def get(self, id):
         '''Get processing tool given its id'''
         return Database.query_asjson(
-            " select * from li3ds.processing where id = %s", (id,)
+            "select {} from li3ds.processing where id=%s"
+            .format(select_list(processing_model)), (id,)
         )
 
     @api.secure
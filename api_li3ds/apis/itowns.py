@@ -1,10 +1,25 @@
 # -*- coding: utf-8 -*-
-from flask import request
+import heapq
+from collections import namedtuple
+from math import hypot
+
+from flask import request, current_app, Response, make_response
 from flask_restplus import fields
+from psycopg2 import DataError
 from psycopg2.extensions import AsIs
 
-from api_li3ds.app import api, Resource
+from api_li3ds.app import (
+    api, Resource, output_format, streaming, stream_json, stream_ndjson, stream_geojson,
+    positive_int, json_payload
+)
 from api_li3ds.database import Database
+from api_li3ds.graph import graphs
+from api_li3ds.cache import disk_cache, content_key
+from api_li3ds.compression import cached_response
+from api_li3ds.encoder import dumps
+from api_li3ds.memo import Memo
+from api_li3ds.changes import changes
+from api_li3ds import trajectory, posestore
 
 
 nsitowns = api.namespace('itowns', description='itowns facilities')
@@ -17,67 +32,429 @@ image_model = nsitowns.model('Image', {
 })
 
 
+Epoch = namedtuple('Epoch', 'rank epoch')
+
+# size of a pixel (meters) at zoom level 0 of web mercator tiles
+ZOOM0_TOLERANCE = 156543.03392804097
+
+# pose columns of the images endpoint
+POSE_COLUMNS = ('easting', 'northing', 'altitude', 'roll', 'pitch', 'heading')
+
+
+def session_project(session_id):
+    '''
+    Returns the name and identifier of the project of a session
+    '''
+    res = Database.query("""
+        select p.id, p.name from li3ds.project p
+        join li3ds.session s on s.project = p.id
+        where s.id = %s
+        """, (session_id, ))
+    if not res:
+        nsitowns.abort(404, 'Session not found')
+    return res[0].name, res[0].id
+
+
+def parse_floats(name, count):
+    '''
+    Parses a comma separated list of count numbers given in the query string
+    '''
+    try:
+        values = [float(value) for value in request.args[name].split(',')]
+    except ValueError:
+        values = []
+    if len(values) != count:
+        nsitowns.abort(400, '{} must be {} comma separated numbers'.format(name, count))
+    return values
+
+
+def image_filters():
+    '''
+    Spatial and temporal filters given in the query string,
+    times are converted to epochs
+    '''
+    filters = {}
+    if 'bbox' in request.args:
+        xmin, ymin, xmax, ymax = parse_floats('bbox', 4)
+        if xmin > xmax or ymin > ymax:
+            nsitowns.abort(400, 'bbox must be xmin,ymin,xmax,ymax')
+        filters.update(xmin=xmin, ymin=ymin, xmax=xmax, ymax=ymax)
+    if 'near' in request.args:
+        filters['near_x'], filters['near_y'] = parse_floats('near', 2)
+        k = request.args.get('k', type=positive_int)
+        if k is None and 'k' in request.args:
+            nsitowns.abort(400, 'k must be a positive integer')
+        filters['k'] = min(k or 10, current_app.config.get('page_size_max', 1000))
+    for key in ('start', 'end'):
+        if key in request.args:
+            try:
+                filters[key] = Database.query_aslist(
+                    "select extract(epoch from %s::timestamptz)::float8", (request.args[key], ))[0]
+            except DataError:
+                nsitowns.abort(400, '{} must be an ISO 8601 timestamp'.format(key))
+    return filters
+
+
+def filter_query(query, filters, columns='t.*'):
+    '''
+    Wraps a poses query with the filters, the stored poses
+    indexes are used when the query is inlined by postgres.
+    Rows are ordered by id, or by distance with the near filter
+    '''
+    point = 'st_makepoint(t.easting::float8, t.northing::float8)'
+    conditions = []
+    if 'xmin' in filters:
+        conditions.append(
+            '{} && st_makeenvelope(%(xmin)s, %(ymin)s, %(xmax)s, %(ymax)s)'.format(point))
+    if 'start' in filters:
+        conditions.append('t.date >= to_timestamp(%(start)s)')
+    if 'end' in filters:
+        conditions.append('t.date <= to_timestamp(%(end)s)')
+    if 'near_x' in filters:
+        order = '{} <-> st_makepoint(%(near_x)s, %(near_y)s) limit %(k)s'.format(point)
+    else:
+        order = 't.id'
+    return 'select {} from ({}) as t{} order by {}'.format(
+        columns, query, ' where ' + ' and '.join(conditions) if conditions else '', order)
+
+
+def filter_poses(poses, filters):
+    '''
+    Same filters as filter_query for (image, pose) tuples
+    '''
+    def selected(item):
+        image, pose = item
+        if 'start' in filters and float(image.epoch) < filters['start']:
+            return False
+        if 'end' in filters and float(image.epoch) > filters['end']:
+            return False
+        if 'xmin' in filters or 'near_x' in filters:
+            if pose['easting'] is None or pose['northing'] is None:
+                return False
+        if 'xmin' in filters:
+            inside_x = filters['xmin'] <= pose['easting'] <= filters['xmax']
+            return inside_x and filters['ymin'] <= pose['northing'] <= filters['ymax']
+        return True
+
+    poses = filter(selected, poses)
+    if 'near_x' in filters:
+        return iter(heapq.nsmallest(filters['k'], poses, key=lambda item: hypot(
+            item[1]['easting'] - filters['near_x'], item[1]['northing'] - filters['near_y'])))
+    return poses
+
+
+def image_feature(image):
+    '''
+    GeoJSON feature of an image pose
+    '''
+    properties = dict(image)
+    coordinates = [properties.pop(key) for key in ('easting', 'northing', 'altitude')]
+    return {
+        'type': 'Feature',
+        'id': properties['id'],
+        'geometry': {
+            'type': 'Point',
+            'coordinates': coordinates,
+        } if None not in coordinates else None,
+        'properties': properties,
+    }
+
+
 @nsitowns.route('/v1/sessions/<int:session_id>/images')
+@nsitowns.doc(params={
+    'engine': 'sql (pc_interpolate), numpy or store (poses precomputed by '
+              'images/refresh, sql for the sessions not up to date), '
+              'defaults to store when filters are given and to the images_engine '
+              'setting otherwise. numpy interpolates angles along the shortest arc '
+              'while pc_interpolate is linear: they differ when an angle wraps '
+              'between two route samples',
+    'format': 'json, ndjson (newline delimited json), geojson (FeatureCollection) '
+              'or binary (columnar arrays), also negotiated with the Accept header',
+    'stream': 'stream the json array as it is read from the database',
+    'bbox': 'only images located in xmin,ymin,xmax,ymax (indexed with the store engine, '
+            'sql and numpy compute the poses of all the images first)',
+    'start': 'only images taken at or after this ISO 8601 time',
+    'end': 'only images taken at or before this ISO 8601 time',
+    'near': 'the k images closest to x,y, nearest first (indexed with the store '
+            'engine, sql and numpy compute the poses of all the images first)',
+    'k': 'number of images returned with near (10 by default)',
+})
 class Images(Resource):
 
     @nsitowns.response(404, 'Session not found')
+    @nsitowns.response(400, 'Unknown engine, format or invalid filter')
     def get(self, session_id):
-        '''List all images in a given session with their location'''
-        # get project name
-        res = Database.query("""
-            select p.id, p.name from li3ds.project p
-            join li3ds.session s on s.project = p.id
-            where s.id = %s
-            """, (session_id, ))
+        '''
+        List all images in a given session with their location.
+        Filters use the indexes of the stored poses with the store engine,
+        the default one when they are given. The other engines only
+        compute the poses of the images taken in [start, end] and apply
+        bbox and near to them.
+        '''
+        project_name, project_id = session_project(session_id)
 
-        if not res:
-            nsitowns.abort(404, 'Session not found')
+        fmt = output_format(('json', 'ndjson', 'geojson', 'binary'))
+        filters = image_filters()
+        engine = request.args.get('engine')
+        if engine is None:
+            engine = 'store' if filters else current_app.config.get('images_engine', 'sql')
+        if engine == 'store':
+            query = posestore.STORE_QUERY
+            parameters = posestore.prepare(project_name, project_id, session_id)
+            if parameters is None:
+                # sessions not refreshed yet are computed on the fly
+                engine = 'sql'
+        if engine == 'sql':
+            query = posestore.POSES_QUERY
+            parameters = {
+                'project': AsIs(project_name),
+                'project_id': project_id,
+                'session': session_id,
+                'start': None,
+                'end': None,
+            }
+        elif engine == 'numpy':
+            query = None
+            poses = filter_poses(
+                self.interpolate(project_name, project_id, session_id, filters), filters)
+        elif engine != 'store':
+            nsitowns.abort(400, 'Unknown engine: {}'.format(engine))
 
-        project_name, project_id = res[0].name, res[0].id
+        if query is not None:
+            parameters.update(filters)
 
-        return Database.query_asjson(
-            """
-            with images as (
-                -- extract image epoch
-                select
-                    i.id,
-                    i.filename,
-                    i.etime,
-                    extract(epoch from etime) as epoch,
-                    rf.sensor
-                from %(project)s.image i
-                join li3ds.datasource ds on i.datasource = ds.id
-                join li3ds.referential rf on ds.referential = rf.id
-                where ds.session = %(session)s
-            ), posdatasource as (
-                -- get latest version of the route
-                select max(pds.id) as id, max(version)
-                from li3ds.project p
-                join li3ds.session s on s.project = p.id
-                join li3ds.posdatasource pds on pds.session = s.id
-                where p.id = %(project_id)s
+        if fmt == 'binary':
+            if query is not None:
+                columns = 't.id, extract(epoch from t.date) as time, {}'.format(
+                    ', '.join('t.' + column for column in POSE_COLUMNS))
+                rows = Database.query(filter_query(query, filters, columns), parameters)
+            else:
+                rows = (
+                    (image.id, float(image.epoch)) + tuple(pose[key] for key in POSE_COLUMNS)
+                    for image, pose in poses
+                )
+            return Response(trajectory.pack(rows), mimetype='application/octet-stream')
+
+        if query is not None:
+            query = filter_query(query, filters)
+            if fmt == 'json' and not streaming():
+                return Database.query_asjson(query, parameters)
+            rows = Database.query_asjson_stream(query, parameters)
+        else:
+            rows = (
+                dict(id=image.id, filename=image.filename, date=image.date,
+                     sensor=image.sensor, **pose)
+                for image, pose in poses
             )
+
+        if fmt == 'ndjson':
+            return stream_ndjson(rows)
+        if fmt == 'geojson':
+            return stream_geojson(image_feature(row) for row in rows)
+        if streaming():
+            return stream_json(rows)
+        return list(rows)
+
+    @staticmethod
+    def interpolate(project_name, project_id, session_id, filters=None):
+        '''
+        Same result as the sql engine, route patches are decoded once
+        and interpolated for all images at a time, only for the images
+        taken in the start and end filters if given.
+        Yields (image, pose) tuples
+        '''
+        filters = filters or {}
+        images = Database.query(
+            """
             select
                 i.id,
                 i.filename,
-                i.etime as date,
-                i.sensor,
-                pc_get(newpt, 'x') as easting,
-                pc_get(newpt, 'y') as northing,
-                pc_get(newpt, 'z') as altitude,
-                pc_get(newpt, 'm_roll') as roll,
-                pc_get(newpt, 'm_pitch') as pitch,
-                pc_get(newpt, 'm_plateformHeading')
-                    - pc_get(newpt, 'm_wanderAngle') as heading
-            from posdatasource pds
-            join %(project)s.route r on pds.id = r.posdatasource
-            join images i on i.etime <@ tstzrange(r.start_time, r.end_time),
-            pc_interpolate(r.points, 'm_time', i.epoch) as newpt
+                to_json(i.etime) as date,
+                rf.sensor,
+                extract(epoch from i.etime) as epoch
+            from %(project)s.image i
+            join li3ds.datasource ds on i.datasource = ds.id
+            join li3ds.referential rf on ds.referential = rf.id
+            where ds.session = %(session)s
+            and (%(start)s::float8 is null or i.etime >= to_timestamp(%(start)s::float8))
+            and (%(end)s::float8 is null or i.etime <= to_timestamp(%(end)s::float8))
+            order by i.etime, i.id
             """,
-            ({'project': AsIs(project_name),
-              'project_id': project_id,
-              'session': session_id})
+            {'project': AsIs(project_name), 'session': session_id,
+             'start': filters.get('start'), 'end': filters.get('end')}
         )
+        if not images:
+            return
+        posdatasource = trajectory.latest_posdatasource(project_id)
+        patches = trajectory.route_patches(
+            project_name, posdatasource,
+            float(images[0].epoch), float(images[-1].epoch))
+        period = current_app.config.get('route_angle_period', 360.)
+        # poses come patch by patch, the sql engine orders them by id
+        yield from sorted(
+            trajectory.poses(images, patches, period), key=lambda item: item[0].id)
+
+
+refresh_model = nsitowns.model('Poses Refresh', {
+    'project': fields.String,
+    'sessions': fields.List(fields.Integer, description='refreshed sessions'),
+})
+
+
+@nsitowns.route('/v1/images/refresh', endpoint='images_refresh')
+@nsitowns.doc(params={
+    'project': 'only refresh the sessions of this project',
+    'session': 'only refresh this session',
+    'force': 'recompute sessions even if they are up to date',
+})
+class ImagesRefresh(Resource):
+
+    @api.secure
+    @nsitowns.marshal_with(refresh_model)
+    def post(self):
+        '''
+        Recompute the stored poses of the sessions whose images
+        or posdatasources changed since their last refresh
+        '''
+        session = request.args.get('session', type=int)
+        force = request.args.get('force', '').lower() in ('1', 'true')
+        projects = Database.query("""
+            select p.id, p.name from li3ds.project p
+            where (%(name)s::varchar is null or p.name = %(name)s)
+            and (%(session)s::integer is null
+                 or p.id = (select project from li3ds.session where id = %(session)s))
+            order by p.id
+            """, {'name': request.args.get('project'), 'session': session})
+        return [
+            {
+                'project': project.name,
+                'sessions': posestore.refresh(project.name, project.id, session, force),
+            }
+            for project in projects
+        ]
+
+
+@nsitowns.route('/v1/sessions/<int:session_id>/trajectory')
+@nsitowns.doc(params={
+    'tolerance': 'simplification tolerance in the route units '
+                 '(trajectory_tolerance setting by default)',
+    'zoom': 'tile zoom level, the tolerance is then the size of a pixel at this level',
+})
+class Trajectory(Resource):
+
+    @nsitowns.response(404, 'Session or route not found')
+    @nsitowns.response(400, 'Invalid tolerance or zoom')
+    def get(self, session_id):
+        '''
+        Get the route of a session as a GeoJSON LineString
+        simplified with the Douglas-Peucker algorithm
+        '''
+        project_name, project_id = session_project(session_id)
+
+        tolerance = self.tolerance()
+        posdatasource = trajectory.latest_posdatasource(project_id)
+        if posdatasource is None:
+            nsitowns.abort(404, 'Route not found')
+
+        # routes of a posdatasource are not modified, new versions are new posdatasources
+        etag = content_key('trajectory', project_name, posdatasource, tolerance)
+        if request.if_none_match.contains_weak(etag):
+            response = make_response('', 304)
+        else:
+            def build():
+                patches = trajectory.route_patches(
+                    project_name, posdatasource, dimensions=('x', 'y', 'z'))
+                line = trajectory.simplify(trajectory.route_line(patches), tolerance)
+                return dumps({
+                    'type': 'Feature',
+                    'geometry': {
+                        'type': 'LineString',
+                        'coordinates': line.tolist(),
+                    },
+                    'properties': {
+                        'posdatasource': posdatasource,
+                        'tolerance': tolerance,
+                        'points': len(line),
+                    },
+                }).encode('utf-8')
+            response = cached_response(
+                disk_cache('trajectory'), etag, build, 'application/geo+json')
+        response.set_etag(etag)
+        response.headers['cache-control'] = 'no-cache'
+        return response
+
+    @staticmethod
+    def tolerance():
+        if 'tolerance' in request.args:
+            tolerance = request.args.get('tolerance', type=float)
+            if tolerance is None or not tolerance >= 0:
+                nsitowns.abort(400, 'tolerance must be a positive number')
+            return tolerance
+        if 'zoom' in request.args:
+            zoom = request.args.get('zoom', type=int)
+            if zoom is None or not 0 <= zoom <= 30:
+                nsitowns.abort(400, 'zoom must be an integer between 0 and 30')
+            return current_app.config.get('trajectory_zoom0_tolerance', ZOOM0_TOLERANCE) / 2 ** zoom
+        return current_app.config.get('trajectory_tolerance', 1.)
+
+
+pose_query_model = nsitowns.model('Pose Query', {
+    'times': fields.List(fields.Float, required=True, description='epochs (seconds)'),
+    'posdatasource': fields.Integer(
+        description='route to use, the latest one of the project by default'),
+})
+
+pose_model = nsitowns.model('Pose', dict(
+    {'time': fields.Float},
+    **{column: fields.Float for column in POSE_COLUMNS}
+))
+
+
+@nsitowns.route('/v1/sessions/<int:session_id>/poses', endpoint='session_poses')
+class Poses(Resource):
+
+    @nsitowns.expect(pose_query_model)
+    @nsitowns.marshal_with(pose_model, as_list=True)
+    @nsitowns.response(404, 'Session or posdatasource not found')
+    @nsitowns.response(413, 'Too many times')
+    def post(self, session_id):
+        '''
+        Get the platform pose at each given time, interpolated like image poses.
+        Poses are returned in the order of the times, with null values
+        for times outside of the route
+        '''
+        project_name, project_id = session_project(session_id)
+        times = api.payload['times']
+        maxitems = current_app.config.get('bulk_max_items', 10000)
+        if len(times) > maxitems:
+            nsitowns.abort(413, 'Too many items (maximum is {})'.format(maxitems))
+
+        posdatasource = api.payload.get('posdatasource')
+        if posdatasource is None:
+            posdatasource = trajectory.latest_posdatasource(project_id)
+        elif not Database.query("""
+                select 1 from li3ds.posdatasource pds
+                join li3ds.session s on s.id = pds.session
+                where pds.id = %s and s.project = %s
+                """, (posdatasource, project_id)):
+            nsitowns.abort(404, 'Posdatasource not found')
+
+        results = [dict(time=time) for time in times]
+        if not times or posdatasource is None:
+            return results
+        epochs = [Epoch(rank, time) for rank, time in enumerate(times)]
+        patches = trajectory.route_patches(project_name, posdatasource, min(times), max(times))
+        period = current_app.config.get('route_angle_period', 360.)
+        for epoch, pose in trajectory.poses(epochs, patches, period):
+            results[epoch.rank].update(pose)
+        return results
+
+
+# camera calibrations by (session, platform config)
+calibrations = Memo('calibration_ttl', 300)
+changes.subscribe(
+    calibrations.invalidate, 'transfo', 'transfo_type', 'transfo_tree', 'datasource',
+    'platform_config', 'referential', 'sensor', 'session')
 
 
 @nsitowns.route('/v1/sessions/<int:session_id>/cameras')
@@ -86,57 +463,73 @@ class Images(Resource):
 })
 class SensorsSession(Resource):
 
+    tables = (
+        'datasource', 'referential', 'sensor', 'transfo', 'transfo_type', 'transfo_tree',
+        'platform_config', 'session')
+
     @nsitowns.response(500, 'parameter required : platform_config')
     def get(self, session_id):
-        '''List all camera calibrations for a given session'''
+        '''List the camera calibrations for a given session, cameras with
+        no chain of transformations up to the ins are not listed
+        '''
         if 'platform_config' not in request.args:
             nsitowns.abort(500, 'parameter required : platform_config')
-        # get all cameras for this platform configuration
-
-        values = Database.query_asjson("""
-            with transfos as (
-                -- all transformations for this platform config
-                select
-                    unnest(tt.transfos) as tid
-                from li3ds.platform_config pf
-                join li3ds.transfo_tree tt on tt.id = ANY(pf.transfo_trees)
-                where pf.id = %(pconfig)s
-            ), ins_transfo as (
-                -- get ins first transformation
-                select trlist.tid as target
-                from transfos trlist
-                join li3ds.transfo tr on tr.id = trlist.tid
-                join li3ds.referential r on tr.source = r.id or tr.target = r.id
-                join li3ds.sensor s on s.id = r.sensor
-                where s.type = 'ins' and r.root
-            ), camera_transfo as (
-                -- get all camera first transformations
-                select tr.id as source, se.*
-                from li3ds.session s
-                join li3ds.datasource ds on ds.session = s.id
-                join li3ds.referential r on r.id = ds.referential
-                join li3ds.sensor se on se.id = r.sensor
-                join li3ds.transfo tr on tr.source = r.id or tr.target = r.id
-                join transfos trlist on trlist.tid = tr.id
-                where s.id = %(session)s and se.type = 'camera'
-            )
-            select
-                id
-                , ARRAY[specifications->'size_x', specifications->'size_y'] as size
-                , _.transfos
-            from
-                camera_transfo
-                , ins_transfo
-                , li3ds.dijkstra(%(pconfig)s, source, target) as path
-                , lateral (
-                    select jsonb_agg(row_to_json(s)) as transfos from
-                    (
-                        select t.id, t.parameters, tt.description, tt.func_name as type
-                         from unnest(path) with ordinality as u(tid, ord)
-                         join li3ds.transfo t on t.id = tid
-                         join li3ds.transfo_type tt on tt.id = t.transfo_type
-                     ) as s
-                ) as _
-            """, ({'pconfig': request.args['platform_config'], 'session': session_id}))
-
-        return values
+        pconfig = request.args.get('platform_config', type=int)
+        if pconfig is None:
+            nsitowns.abort(400, 'platform_config must be an integer')
+
+        return calibrations.get(
+            (session_id, pconfig),
+            lambda: json_payload(camera_calibrations(session_id, pconfig))
+        ).response()
+
+
+def camera_calibrations(session_id, pconfig):
+    '''
+    Cameras of a session with their transformation chains up to the ins
+    in a platform configuration, valid during the session. Cameras with
+    no chain are left out
+    '''
+    graph = graphs.get(pconfig)
+    period = Database.query(
+        "select start_time, end_time from li3ds.session where id = %s", (session_id, ))
+    start, end = tuple(period[0]) if period else (None, None)
+
+    # get all cameras used in this session
+    cameras = Database.query("""
+        select distinct r.id as referential, se.id, se.specifications
+        from li3ds.datasource ds
+        join li3ds.referential r on r.id = ds.referential
+        join li3ds.sensor se on se.id = r.sensor
+        where ds.session = %s and se.type = 'camera'
+        order by se.id
+        """, (session_id, ))
+
+    # camera chains up to the ins root referential
+    chains = []
+    for ins in graph.roots('ins'):
+        paths = graph.paths([camera.referential for camera in cameras], ins, start, end)
+        chains.extend(
+            (camera, paths[camera.referential]) for camera in cameras
+            if paths[camera.referential] is not None)
+
+    tids = sorted(set(tid for _, path in chains for tid in path))
+    transfos = {
+        transfo.id: transfo._asdict()
+        for transfo in Database.query("""
+            select t.id, t.parameters, tt.description, tt.func_name as type
+            from li3ds.transfo t
+            join li3ds.transfo_type tt on tt.id = t.transfo_type
+            where t.id = ANY(%s)
+            """, (tids, ))
+    }
+
+    values = []
+    for camera, path in chains:
+        specs = camera.specifications or {}
+        values.append({
+            'id': camera.id,
+            'size': [specs.get('size_x'), specs.get('size_y')],
+            'transfos': [transfos[tid] for tid in path if tid in transfos],
+        })
+    return values
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+from flask_restplus import fields
+
+from api_li3ds.app import api, Resource
+from api_li3ds.database import Database
+from api_li3ds.metrics import metrics
+from api_li3ds.changes import changes
+
+nsmonitoring = api.namespace('monitoring', description='monitoring facilities')
+
+pool_model = nsmonitoring.model('Pool Stats', {
+    'min': fields.Integer(description='connections always kept open'),
+    'max': fields.Integer(description='maximum number of connections'),
+    'size': fields.Integer(description='connections currently opened'),
+    'idle': fields.Integer(description='connections available'),
+    'used': fields.Integer(description='connections checked out'),
+    'connections': fields.Integer(description='connections opened since startup', default=0),
+    'discarded': fields.Integer(description='broken connections thrown away', default=0),
+    'closed': fields.Integer(description='idle connections closed', default=0),
+    'checkouts': fields.Integer(description='total checkouts', default=0),
+    'timeouts': fields.Integer(description='checkouts that timed out', default=0),
+    'wait_time': fields.Float(description='total time spent waiting for a connection (s)', default=0),
+    'max_wait_time': fields.Float(description='longest wait for a connection (s)', default=0),
+})
+
+
+@nsmonitoring.route('/pool/', endpoint='monitoring_pool')
+class PoolStats(Resource):
+
+    @nsmonitoring.marshal_with(pool_model)
+    def get(self):
+        '''Database connection pool statistics'''
+        return Database.pool_stats()
+
+
+statements_model = nsmonitoring.model('Prepared Statements Stats', {
+    'hits': fields.Integer(description='queries run with an already prepared statement', default=0),
+    'misses': fields.Integer(description='queries not found in the statements cache', default=0),
+    'prepares': fields.Integer(description='statements prepared', default=0),
+    'failures': fields.Integer(description='queries that could not be prepared', default=0),
+    'evictions': fields.Integer(description='statements removed from the cache', default=0),
+    'invalidations': fields.Integer(description='statements prepared again after a schema change', default=0),
+})
+
+
+@nsmonitoring.route('/statements/', endpoint='monitoring_statements')
+class StatementStats(Resource):
+
+    @nsmonitoring.marshal_with(statements_model)
+    def get(self):
+        '''Prepared statements cache statistics'''
+        return Database.statement_stats()
+
+
+query_model = nsmonitoring.model('Query', {
+    'fingerprint': fields.String(description='query label used in /metrics'),
+    'query': fields.String(description='normalized query text'),
+})
+
+
+@nsmonitoring.route('/queries/', endpoint='monitoring_queries')
+class Queries(Resource):
+
+    @nsmonitoring.marshal_with(query_model)
+    def get(self):
+        '''Queries run by this process, by fingerprint'''
+        return [
+            {'fingerprint': fp, 'query': query}
+            for fp, query in sorted(metrics.queries().items())
+        ]
+
+
+changes_model = nsmonitoring.model('Table Changes', {
+    'active': fields.Boolean(description='listening to the change notifications'),
+    'generations': fields.Raw(description='last generation of each table'),
+})
+
+
+@nsmonitoring.route('/changes/', endpoint='monitoring_changes')
+class ChangesStats(Resource):
+
+    @nsmonitoring.marshal_with(changes_model)
+    def get(self):
+        '''Tables generations notified by postgres'''
+        return {'active': changes.active, 'generations': changes.generations()}
@@ -1,11 +1,19 @@
 # -*- coding: utf-8 -*-
-from flask import make_response
+from flask import make_response, request
 from flask_restplus import fields
 from graphviz import Digraph
 
-from api_li3ds.app import api, Resource, defaultpayload
+from api_li3ds.app import (
+    api, Resource, defaultpayload, paginate, collection_params, object_params, select_list,
+    after_write, by_ids, ids_model
+)
 from api_li3ds.database import Database
+from api_li3ds.expand import relation, expanded, expand_params
+from api_li3ds.graph import graphs
+from .itowns import calibrations
+from api_li3ds.cache import disk_cache, content_key
 from .sensor import sensor_model
+from .transfotree import transfotree_model
 
 nspfm = api.namespace('platforms', description='platforms related operations')
 
@@ -40,14 +48,23 @@ platform_config = nspfm.inherit(
         'id': fields.Integer,
     })
 
+relation('platform_config', 'platform', 'platform', platform_model,
+         '{child}.id = {parent}.platform')
+relation('platform_config', 'transfo_trees', 'transfo_tree', transfotree_model,
+         '{child}.id = any({parent}.transfo_trees)', many=True)
+
 
 @nspfm.route('/', endpoint='platforms')
 class Platforms(Resource):
 
+    tables = ('platform',)
+
     @nspfm.marshal_with(platform_model)
+    @nspfm.doc(params=collection_params)
     def get(self):
         '''List platforms'''
-        return Database.query_asjson("select * from li3ds.platform")
+        return paginate(
+            "select {} from li3ds.platform".format(select_list(platform_model)), platform_model)
 
     @api.secure
     @nspfm.expect(platform_model_post)
@@ -63,15 +80,31 @@ class Platforms(Resource):
         ), 201
 
 
+@nspfm.route('/lookup/', endpoint='platforms_lookup')
+class LookupPlatforms(Resource):
+
+    @nspfm.expect(ids_model)
+    @nspfm.marshal_with(platform_model, as_list=True)
+    @nspfm.response(413, 'Too many identifiers')
+    def post(self):
+        '''Get platforms given their identifiers, in the same order.
+        Same as the ids parameter, for long lists
+        '''
+        return by_ids("select * from li3ds.platform", api.payload['ids'])
+
+
 @nspfm.route('/<int:id>/', endpoint='platform')
 @nspfm.response(404, 'Platform not found')
 class OnePlatform(Resource):
 
+    tables = ('platform',)
+
     @nspfm.marshal_with(platform_model)
+    @nspfm.doc(params=object_params)
     def get(self, id):
         '''Get one platform given its identifier'''
         res = Database.query_asjson(
-            "select * from li3ds.platform where id=%s", (id,)
+            "select {} from li3ds.platform where id=%s".format(select_list(platform_model)), (id,)
         )
         if not res:
             nspfm.abort(404, 'Platform not found')
@@ -90,11 +123,15 @@ class OnePlatform(Resource):
 @nspfm.route('/<int:id>/configs/', endpoint='platform_configs')
 class PlatformConfigs(Resource):
 
+    tables = ('platform_config',)
+
     @nspfm.marshal_with(platform_config)
+    @nspfm.doc(params=object_params)
     def get(self, id):
         '''List all platform configurations'''
         return Database.query_asjson(
-            "select * from li3ds.platform_config where platform = %s", (id,)
+            "select {} from li3ds.platform_config where platform = %s"
+            .format(select_list(platform_config)), (id,)
         )
 
     @api.secure
@@ -114,14 +151,22 @@ class PlatformConfigs(Resource):
 @nspfm.param('id', 'The platform config identifier')
 class OnePlatformConfig(Resource):
 
+    tables = ('platform_config',)
+
+    @nspfm.doc(params=dict(object_params, **expand_params('platform_config')))
     def get(self, id):
         '''Get a platform configuration given its identifier'''
+        res = expanded('platform_config', platform_config, 't.id = %s', (id,))
+        if res is not None:
+            return res
         return Database.query_asjson(
-            "select * from li3ds.platform_config where id = %s", (id,)
+            "select {} from li3ds.platform_config where id = %s"
+            .format(select_list(platform_config, key=None)), (id,)
         )
 
     @api.secure
     @nspfm.response(410, 'Platform configuration deleted')
+    @after_write(graphs.invalidate, calibrations.invalidate)
     def delete(self, id):
         '''Delete a platform configuration given its identifier'''
         res = Database.rowcount("delete from li3ds.platform_config where id=%s", (id,))
@@ -164,48 +209,67 @@ class PlatformConfigPreview(Resource):
             from li3ds.referential where ARRAY[id] <@ %s
         """, (list(urefs), ))
 
-        dot = Digraph(comment='Transformations')
+        # the image only depends on the graph content
+        etag = content_key(sorted(nodes), sorted(edges))
+        if etag in request.if_none_match:
+            response = make_response('', 304)
+        else:
+            cache = disk_cache('preview')
+            data = cache.get(etag)
+            if data is None:
+                data = render_preview(nodes, edges)
+                cache.set(etag, data)
+            response = make_response(data)
+            response.headers['content-type'] = 'image/png'
+            response.mimetype = 'image/png'
+        response.set_etag(etag)
+        # browsers must revalidate but can keep the image
+        response.headers['cache-control'] = 'no-cache'
+        return response
+
 
-        for node in nodes:
-            if node.root:
-                dot.node(str(node.id), '{}\n({})'.format(node.name, node.id), color='red')
-                continue
-            dot.node(str(node.id), '{}\n({})'.format(node.name, node.id))
+def render_preview(nodes, edges):
+    '''Renders the transformations graph as png using graphviz'''
+    dot = Digraph(comment='Transformations')
 
-        for edge in edges:
-            if edge.sc:
-                # highlight sensor connections in blue
-                dot.edge(
-                    str(edge.source),
-                    str(edge.target),
-                    label='{}'.format(edge.id),
-                    color='blue')
-                continue
+    for node in nodes:
+        if node.root:
+            dot.node(str(node.id), '{}\n({})'.format(node.name, node.id), color='red')
+            continue
+        dot.node(str(node.id), '{}\n({})'.format(node.name, node.id))
+
+    for edge in edges:
+        if edge.sc:
+            # highlight sensor connections in blue
             dot.edge(
                 str(edge.source),
                 str(edge.target),
-                label='{}'.format(edge.id))
-
-        dot.graph_attr = {'overlap': 'scalexy'}
-        dot.engine = 'dot'
-        data = dot.pipe("png")
+                label='{}'.format(edge.id),
+                color='blue')
+            continue
+        dot.edge(
+            str(edge.source),
+            str(edge.target),
+            label='{}'.format(edge.id))
 
-        response = make_response(data)
-        response.headers['content-type'] = 'image/png'
-        response.mimetype = 'image/png'
-        return response
+    dot.graph_attr = {'overlap': 'scalexy'}
+    dot.engine = 'dot'
+    return dot.pipe("png")
 
 
 @nspfm.route('/configs/<int:id>/sensors/', endpoint='platform_config_sensors')
 @nspfm.param('id', 'The platform config identifier')
 class PlatformConfigSensors(Resource):
 
+    tables = ('platform_config', 'transfo_tree', 'transfo', 'referential', 'sensor')
+
     @nspfm.marshal_with(sensor_model)
+    @nspfm.doc(params=object_params)
     def get(self, id):
         '''Get all sensors used in a given platform configuration'''
         return Database.query_asjson("""
             select
-               distinct s.*
+               distinct {}
             from li3ds.platform_config pf
             join li3ds.transfo_tree tt on tt.id = ANY(pf.transfo_trees)
             , lateral unnest(tt.transfos) as tid
@@ -213,4 +277,4 @@ class PlatformConfigSensors(Resource):
             join li3ds.referential r on r.id = t.source or r.id = t.target
             join li3ds.sensor s on s.id = r.sensor
             where pf.id = %s
-            """, (id,))
+            """.format(select_list(sensor_model, 's')), (id,))
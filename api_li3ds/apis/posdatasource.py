@@ -1,8 +1,13 @@
 # -*- coding: utf-8 -*-
 from flask_restplus import fields
 
-from api_li3ds.app import api, Resource, defaultpayload
+from api_li3ds.app import (
+    api, Resource, defaultpayload, paginate, collection_params, object_params, select_list,
+    by_ids, ids_model
+)
 from api_li3ds.database import Database
+from api_li3ds.expand import relation
+from .referential import referential_model
 
 
 nspds = api.namespace('posdatasources', description='positional datasources related operations')
@@ -19,6 +24,10 @@ posdatasource_model = nspds.inherit('Posdatasource Model', posdatasource_model_p
     'id': fields.Integer,
 })
 
+relation('posdatasource', 'referential', 'referential', referential_model,
+         '{child}.id = {parent}.referential')
+relation('posdatasource', 'session', 'session', 'Session Model', '{child}.id = {parent}.session')
+
 posprocessing_model_post = nspds.model('PosProcessing Model Post', {
     'launched': fields.DateTime(dt_format='iso8601', default=None),
     'tool': fields.String(required=True),
@@ -35,10 +44,15 @@ posprocessing_model = nspds.inherit('PosProcessing Model', posprocessing_model_p
 @nspds.route('/', endpoint='posdatasources')
 class PosDatasources(Resource):
 
+    tables = ('posdatasource',)
+
     @nspds.marshal_with(posdatasource_model)
+    @nspds.doc(params=collection_params)
     def get(self):
         '''Get all datasources'''
-        return Database.query_asjson("select * from li3ds.posdatasource")
+        return paginate(
+            "select {} from li3ds.posdatasource"
+            .format(select_list(posdatasource_model)), posdatasource_model)
 
     @api.secure
     @nspds.expect(posdatasource_model_post)
@@ -54,15 +68,32 @@ class PosDatasources(Resource):
         ), 201
 
 
+@nspds.route('/lookup/', endpoint='posdatasources_lookup')
+class LookupPosDatasources(Resource):
+
+    @nspds.expect(ids_model)
+    @nspds.marshal_with(posdatasource_model, as_list=True)
+    @nspds.response(413, 'Too many identifiers')
+    def post(self):
+        '''Get positional datasources given their identifiers, in the same order.
+        Same as the ids parameter, for long lists
+        '''
+        return by_ids("select * from li3ds.posdatasource", api.payload['ids'])
+
+
 @nspds.route('/<int:id>/', endpoint='posdatasource')
 @nspds.response(404, 'PosDatasource not found')
 class OnePosDatasource(Resource):
 
+    tables = ('posdatasource',)
+
     @nspds.marshal_with(posdatasource_model)
+    @nspds.doc(params=object_params)
     def get(self, id):
         '''Get one datasource given its identifier'''
         res = Database.query_asjson(
-            "select * from li3ds.posdatasource where id=%s", (id,)
+            "select {} from li3ds.posdatasource where id=%s"
+            .format(select_list(posdatasource_model)), (id,)
         )
         if not res:
             nspds.abort(404, 'PosDatasource not found')
@@ -83,18 +114,22 @@ class OnePosDatasource(Resource):
 @nspds.response(404, 'PosDatasource not found')
 class PosProcessing(Resource):
 
+    tables = ('posdatasource', 'posprocessing')
+
     @nspds.marshal_with(posprocessing_model)
+    @nspds.doc(params=object_params)
     def get(self, id):
         '''Get the posprocessing tool used to generate this datasource'''
         res = Database.query_asjson(
-            "select * from li3ds.posdatasource where id=%s", (id,)
+            "select id from li3ds.posdatasource where id=%s", (id,)
         )
         if not res:
             nspds.abort(404, 'PosDatasource not found')
 
         return Database.query_asjson(
-            " select p.* from li3ds.posprocessing p"
-            " join li3ds.posdatasource s on s.id = p.target where s.id=%s",
+            " select {} from li3ds.posprocessing p"
+            " join li3ds.posdatasource s on s.id = p.target where s.id=%s"
+            .format(select_list(posprocessing_model, 'p')),
             (id,)
         )
 
@@ -117,11 +152,15 @@ class PosProcessing(Resource):
 @nspds.response(404, 'PosProcessing not found')
 class OneProcessing(Resource):
 
+    tables = ('posprocessing',)
+
     @nspds.marshal_with(posprocessing_model)
+    @nspds.doc(params=object_params)
     def get(self, id):
         '''Get posprocessing tool given its id'''
         return Database.query_asjson(
-            " select * from li3ds.posprocessing where id = %s", (id,)
+            "select {} from li3ds.posprocessing where id=%s"
+            .format(select_list(posprocessing_model)), (id,)
         )
 
     @api.secure
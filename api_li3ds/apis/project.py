@@ -2,7 +2,9 @@
 from flask_restplus import fields
 
 from api_li3ds.database import Database
-from api_li3ds.app import api, Resource, defaultpayload
+from api_li3ds.app import (
+    api, Resource, defaultpayload, paginate, collection_params, object_params, select_list
+)
 from .session import session_model
 
 
@@ -34,10 +36,14 @@ project_model = nsproject.inherit('Project Model', project_model_post, {
 @nsproject.route('/', endpoint='projects')
 class Projects(Resource):
 
+    tables = ('project',)
+
     @nsproject.marshal_with(project_model)
+    @nsproject.doc(params=collection_params)
     def get(self):
         '''List all projects'''
-        return Database.query_asjson("select * from li3ds.project")
+        return paginate(
+            "select {} from li3ds.project".format(select_list(project_model)), project_model)
 
     @api.secure
     @nsproject.expect(project_model_post)
@@ -58,10 +64,15 @@ class Projects(Resource):
 @nsproject.param('name', 'The project name')
 class OneProject(Resource):
 
+    tables = ('project',)
+
     @nsproject.marshal_with(project_model)
+    @nsproject.doc(params=object_params)
     def get(self, name):
         '''Get a project given its name'''
-        res = Database.query_asjson("select * from li3ds.project where name=%s", (name,))
+        res = Database.query_asjson(
+            "select {} from li3ds.project where name=%s".format(select_list(project_model)),
+            (name,))
         if not res:
             nsproject.abort(404, 'Project not found')
         return res
@@ -73,7 +84,7 @@ class OneProject(Resource):
         '''
         Delete a project.
         '''
-        res = Database.query_asjson("select * from li3ds.project where name=%s", (name,))
+        res = Database.query_asjson("select id from li3ds.project where name=%s", (name,))
         if not res:
             nsproject.abort(404, 'Project not found')
         Database.query_aslist("select li3ds.delete_project(%s)", (name,))
@@ -85,14 +96,17 @@ class OneProject(Resource):
 @nsproject.param('name', 'The project name')
 class Sessions(Resource):
 
+    tables = ('project', 'session')
+
     @nsproject.marshal_with(session_model)
+    @nsproject.doc(params=object_params)
     def get(self, name):
         '''List all sessions for a given project'''
-        res = Database.query_asjson("select * from li3ds.project where name=%s", (name,))
+        res = Database.query_asjson("select id from li3ds.project where name=%s", (name,))
         if not res:
             nsproject.abort(404, 'Project not found')
         return Database.query_asjson(
-            """select s.* from li3ds.session s
+            """select {} from li3ds.session s
             join li3ds.project p on s.project=p.id where p.name=%s
-            """, (name,)
+            """.format(select_list(session_model, 's')), (name,)
         )
@@ -1,8 +1,13 @@
 # -*- coding: utf-8 -*-
 from flask_restplus import fields
 
-from api_li3ds.app import api, Resource, defaultpayload
+from api_li3ds.app import (
+    api, Resource, defaultpayload, paginate, collection_params, object_params, select_list,
+    bulk_payload, by_ids, ids_model
+)
 from api_li3ds.database import Database
+from api_li3ds.expand import relation, expanded, expand_params
+from .sensor import sensor_model
 
 nsrf = api.namespace('referentials', description='referentials related operations')
 
@@ -23,6 +28,8 @@ referential_model = nsrf.inherit(
         'id': fields.Integer
     })
 
+relation('referential', 'sensor', 'sensor', sensor_model, '{child}.id = {parent}.sensor')
+
 
 transfo_model = nsrf.model(
     'Transfo Model',
@@ -42,10 +49,15 @@ transfo_model = nsrf.model(
 @nsrf.route('/', endpoint='referentials')
 class Referential(Resource):
 
+    tables = ('referential',)
+
     @nsrf.marshal_with(referential_model)
+    @nsrf.doc(params=collection_params)
     def get(self):
         '''List Referentials'''
-        return Database.query_asjson("select * from li3ds.referential")
+        return paginate(
+            "select {} from li3ds.referential"
+            .format(select_list(referential_model)), referential_model)
 
     @api.secure
     @nsrf.expect(referential_model_post)
@@ -61,15 +73,53 @@ class Referential(Resource):
         ), 201
 
 
+@nsrf.route('/lookup/', endpoint='referentials_lookup')
+class LookupReferentials(Resource):
+
+    @nsrf.expect(ids_model)
+    @nsrf.marshal_with(referential_model, as_list=True)
+    @nsrf.response(413, 'Too many identifiers')
+    def post(self):
+        '''Get referentials given their identifiers, in the same order.
+        Same as the ids parameter, for long lists
+        '''
+        return by_ids("select * from li3ds.referential", api.payload['ids'])
+
+
+@nsrf.route('/bulk/', endpoint='referentials_bulk')
+class BulkReferentials(Resource):
+
+    tables = ('referential',)
+
+    @api.secure
+    @nsrf.expect(([referential_model_post], 'json array or newline delimited json'))
+    @nsrf.response(201, 'Referentials created')
+    def post(self):
+        '''Create referentials in a single transaction, returns their identifiers'''
+        return Database.insert_many(
+            "insert into li3ds.referential (name, description, srid, root, sensor) "
+            "values {} returning id",
+            "(%(name)s, %(description)s, %(srid)s, %(root)s, %(sensor)s)",
+            bulk_payload(referential_model_post)
+        ), 201
+
+
 @nsrf.route('/<int:id>/', endpoint='referential')
 @nsrf.response(404, 'Referential not found')
 class OneReferential(Resource):
 
+    tables = ('referential',)
+
     @nsrf.marshal_with(referential_model)
+    @nsrf.doc(params=dict(object_params, **expand_params('referential')))
     def get(self, id):
         '''Get one referential given its identifier'''
+        res = expanded('referential', referential_model, 't.id = %s', (id,), 'Referential not found')
+        if res is not None:
+            return res
         res = Database.query_asjson(
-            "select * from li3ds.referential where id=%s", (id,)
+            "select {} from li3ds.referential where id=%s"
+            .format(select_list(referential_model)), (id,)
         )
         if not res:
             nsrf.abort(404, 'Referential not found')
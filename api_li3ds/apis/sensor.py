@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 from flask_restplus import fields
 
-from api_li3ds.app import api, Resource, defaultpayload
+from api_li3ds.app import (
+    api, Resource, defaultpayload, paginate, collection_params, object_params, select_list,
+    bulk_payload, by_ids, ids_model
+)
 from api_li3ds.database import Database
 
 
@@ -32,10 +35,14 @@ sensor_model = nssensor.inherit(
 @nssensor.route('/', endpoint='sensors')
 class Sensors(Resource):
 
+    tables = ('sensor',)
+
     @nssensor.marshal_with(sensor_model)
+    @nssensor.doc(params=collection_params)
     def get(self):
         '''List sensors'''
-        return Database.query_asjson("select * from li3ds.sensor")
+        return paginate(
+            "select {} from li3ds.sensor".format(select_list(sensor_model)), sensor_model)
 
     @api.secure
     @nssensor.expect(sensor_model_post)
@@ -55,15 +62,55 @@ class Sensors(Resource):
         ), 201
 
 
+@nssensor.route('/lookup/', endpoint='sensors_lookup')
+class LookupSensors(Resource):
+
+    @nssensor.expect(ids_model)
+    @nssensor.marshal_with(sensor_model, as_list=True)
+    @nssensor.response(413, 'Too many identifiers')
+    def post(self):
+        '''Get sensors given their identifiers, in the same order.
+        Same as the ids parameter, for long lists
+        '''
+        return by_ids("select * from li3ds.sensor", api.payload['ids'])
+
+
+@nssensor.route('/bulk/', endpoint='sensors_bulk')
+class BulkSensors(Resource):
+
+    tables = ('sensor',)
+
+    @api.secure
+    @nssensor.expect(([sensor_model_post], 'json array or newline delimited json'))
+    @nssensor.response(201, 'Sensors created')
+    def post(self):
+        '''Create sensors in a single transaction, returns their identifiers'''
+        return Database.insert_many(
+            """
+            insert into li3ds.sensor (serial_number, short_name, brand,
+                                      model, description, specifications, type)
+            values {} returning id
+            """,
+            """
+            (%(serial_number)s, %(short_name)s, %(brand)s, %(model)s,
+             %(description)s, %(specifications)s, %(type)s)
+            """,
+            bulk_payload(sensor_model_post)
+        ), 201
+
+
 @nssensor.route('/<int:id>/', endpoint='sensor')
 @nssensor.response(404, 'Sensor not found')
 class OneSensor(Resource):
 
+    tables = ('sensor',)
+
     @nssensor.marshal_with(sensor_model)
+    @nssensor.doc(params=object_params)
     def get(self, id):
         '''Get one sensor given its identifier'''
         res = Database.query_asjson(
-            "select * from li3ds.sensor where id=%s", (id,)
+            "select {} from li3ds.sensor where id=%s".format(select_list(sensor_model)), (id,)
         )
         if not res:
             nssensor.abort(404, 'sensor not found')
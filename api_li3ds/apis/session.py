@@ -1,10 +1,15 @@
 # -*- coding: utf-8 -*-
 from flask_restplus import fields
 
-from api_li3ds.app import api, Resource, defaultpayload
+from api_li3ds.app import (
+    api, Resource, defaultpayload, paginate, collection_params, object_params, select_list,
+    by_ids, ids_model
+)
 from api_li3ds.database import Database
+from api_li3ds.expand import relation, expanded, expand_params
 from .datasource import datasource_model
 from .posdatasource import posdatasource_model
+from .platform import platform_model
 
 nssession = api.namespace('sessions', description='sessions related operations')
 
@@ -21,14 +26,24 @@ session_model = nssession.inherit('Session Model', session_model_post, {
     'id': fields.Integer,
 })
 
+relation('session', 'platform', 'platform', platform_model, '{child}.id = {parent}.platform')
+relation('session', 'datasources', 'datasource', datasource_model,
+         '{child}.session = {parent}.id', many=True)
+relation('session', 'posdatasources', 'posdatasource', posdatasource_model,
+         '{child}.session = {parent}.id', many=True)
+
 
 @nssession.route('/', endpoint='sessions')
 class AllSessions(Resource):
 
+    tables = ('session',)
+
     @nssession.marshal_with(session_model)
+    @nssession.doc(params=collection_params)
     def get(self):
         '''Get all sessions'''
-        return Database.query_asjson("select * from li3ds.session")
+        return paginate(
+            "select {} from li3ds.session".format(select_list(session_model)), session_model)
 
     @api.secure
     @nssession.expect(session_model_post)
@@ -44,15 +59,34 @@ class AllSessions(Resource):
         ), 201
 
 
+@nssession.route('/lookup/', endpoint='sessions_lookup')
+class LookupSessions(Resource):
+
+    @nssession.expect(ids_model)
+    @nssession.marshal_with(session_model, as_list=True)
+    @nssession.response(413, 'Too many identifiers')
+    def post(self):
+        '''Get sessions given their identifiers, in the same order.
+        Same as the ids parameter, for long lists
+        '''
+        return by_ids("select * from li3ds.session", api.payload['ids'])
+
+
 @nssession.route('/<int:id>/', endpoint='session')
 @nssession.response(404, 'Session not found')
 class OneSession(Resource):
 
+    tables = ('session',)
+
     @nssession.marshal_with(session_model)
+    @nssession.doc(params=dict(object_params, **expand_params('session')))
     def get(self, id):
         '''Get one session given its identifier'''
+        res = expanded('session', session_model, 't.id = %s', (id,))
+        if res is not None:
+            return res
         return Database.query_asjson(
-            "select * from li3ds.session where id=%s", (id,)
+            "select {} from li3ds.session where id=%s".format(select_list(session_model)), (id,)
         )
 
     @api.secure
@@ -69,37 +103,46 @@ class OneSession(Resource):
 @nssession.param('id', 'The session identifier')
 class Platform(Resource):
 
-    @nssession.marshal_with(session_model)
+    tables = ('session', 'platform')
+
+    @nssession.marshal_with(platform_model)
+    @nssession.doc(params=object_params)
     def get(self, id):
         '''Get the platform used by the given session'''
         return Database.query_asjson(
-            """select p.* from li3ds.platform p
+            """select {} from li3ds.platform p
             join li3ds.session s on s.platform = p.id where s.id=%s
-            """, (id,)
+            """.format(select_list(platform_model, 'p')), (id,)
         )
 
 
 @nssession.route('/<int:id>/datasources/', endpoint='session_datasources')
 class Datasources(Resource):
 
+    tables = ('session', 'datasource')
+
     @nssession.marshal_with(datasource_model)
+    @nssession.doc(params=object_params)
     def get(self, id):
         '''List session datasources'''
         return Database.query_asjson(
-            """select d.* from li3ds.session s
+            """select {} from li3ds.session s
             join li3ds.datasource d on d.session = s.id
             where s.id = %s
-            """, (id,))
+            """.format(select_list(datasource_model, 'd')), (id,))
 
 
 @nssession.route('/<int:id>/posdatasources/', endpoint='session_posdatasources')
 class PosDatasources(Resource):
 
+    tables = ('session', 'posdatasource')
+
     @nssession.marshal_with(posdatasource_model)
+    @nssession.doc(params=object_params)
     def get(self, id):
         '''List session positional datasources'''
         return Database.query_asjson(
-            """select d.* from li3ds.session s
+            """select {} from li3ds.session s
             join li3ds.posdatasource d on d.session = s.id
             where s.id = %s
-            """, (id,))
+            """.format(select_list(posdatasource_model, 'd')), (id,))
@@ -1,8 +1,13 @@
 # -*- coding: utf-8 -*-
 from flask_restplus import fields
 
-from api_li3ds.app import api, Resource, defaultpayload
+from api_li3ds.app import (
+    api, Resource, defaultpayload, paginate, collection_params, object_params, select_list,
+    after_write, bulk_payload, by_ids, ids_model
+)
 from api_li3ds.database import Database
+from api_li3ds.graph import graphs
+from .itowns import calibrations
 
 nstf = api.namespace('transfos', description='transformations related operations')
 
@@ -47,15 +52,20 @@ transfotype_model = nstf.inherit(
 @nstf.route('/', endpoint='transfos')
 class Transfo(Resource):
 
+    tables = ('transfo',)
+
     @nstf.marshal_with(transfo_model)
+    @nstf.doc(params=collection_params)
     def get(self):
         '''List all transformations'''
-        return Database.query_asjson("select * from li3ds.transfo")
+        return paginate(
+            "select {} from li3ds.transfo".format(select_list(transfo_model)), transfo_model)
 
     @api.secure
     @nstf.expect(transfo_model_post)
     @nstf.marshal_with(transfo_model)
     @nstf.response(201, 'Transformation created')
+    @after_write(graphs.invalidate, calibrations.invalidate)
     def post(self):
         '''Create a transformation between referentials'''
         return Database.query_asdict(
@@ -69,15 +79,56 @@ class Transfo(Resource):
         ), 201
 
 
+@nstf.route('/lookup/', endpoint='transfos_lookup')
+class LookupTransfos(Resource):
+
+    @nstf.expect(ids_model)
+    @nstf.marshal_with(transfo_model, as_list=True)
+    @nstf.response(413, 'Too many identifiers')
+    def post(self):
+        '''Get transformations given their identifiers, in the same order.
+        Same as the ids parameter, for long lists
+        '''
+        return by_ids("select * from li3ds.transfo", api.payload['ids'])
+
+
+@nstf.route('/bulk/', endpoint='transfos_bulk')
+class BulkTransfos(Resource):
+
+    tables = ('transfo',)
+
+    @api.secure
+    @nstf.expect(([transfo_model_post], 'json array or newline delimited json'))
+    @nstf.response(201, 'Transformations created')
+    @after_write(graphs.invalidate, calibrations.invalidate)
+    def post(self):
+        '''Create transformations in a single transaction, returns their identifiers'''
+        return Database.insert_many(
+            """
+            insert into li3ds.transfo (source, target, transfo_type, description,
+                                       parameters, tdate, validity_start, validity_end)
+            values {} returning id
+            """,
+            """
+            (%(source)s, %(target)s, %(transfo_type)s, %(description)s,
+             %(parameters)s, %(tdate)s, %(validity_start)s, %(validity_end)s)
+            """,
+            bulk_payload(transfo_model_post)
+        ), 201
+
+
 @nstf.route('/<int:id>/', endpoint='transfo')
 @nstf.response(404, 'Transformation not found')
 class OneTransfo(Resource):
 
+    tables = ('transfo',)
+
     @nstf.marshal_with(transfo_model)
+    @nstf.doc(params=object_params)
     def get(self, id):
         '''Get one transformation given its identifier'''
         res = Database.query_asjson(
-            "select * from li3ds.transfo where id=%s", (id,)
+            "select {} from li3ds.transfo where id=%s".format(select_list(transfo_model)), (id,)
         )
         if not res:
             nstf.abort(404, 'Transformation not found')
@@ -85,6 +136,7 @@ class OneTransfo(Resource):
 
     @api.secure
     @nstf.response(410, 'Transformation deleted')
+    @after_write(graphs.invalidate, calibrations.invalidate)
     def delete(self, id):
         '''Delete a transformation given its identifier'''
         res = Database.rowcount("delete from li3ds.transfo where id=%s", (id,))
@@ -96,10 +148,15 @@ class OneTransfo(Resource):
 @nstf.route('/types/', endpoint='transfotypes')
 class TransfoType(Resource):
 
+    tables = ('transfo_type',)
+
     @nstf.marshal_with(transfotype_model)
+    @nstf.doc(params=collection_params)
     def get(self):
         '''List all transformation types'''
-        return Database.query_asjson("select * from li3ds.transfo_type")
+        return paginate(
+            "select {} from li3ds.transfo_type"
+            .format(select_list(transfotype_model)), transfotype_model)
 
     @api.secure
     @nstf.expect(transfotype_model_post)
@@ -117,15 +174,32 @@ class TransfoType(Resource):
         ), 201
 
 
+@nstf.route('/types/lookup/', endpoint='transfotypes_lookup')
+class LookupTransfoTypes(Resource):
+
+    @nstf.expect(ids_model)
+    @nstf.marshal_with(transfotype_model, as_list=True)
+    @nstf.response(413, 'Too many identifiers')
+    def post(self):
+        '''Get transformation types given their identifiers, in the same order.
+        Same as the ids parameter, for long lists
+        '''
+        return by_ids("select * from li3ds.transfo_type", api.payload['ids'])
+
+
 @nstf.route('/types/<int:id>/', endpoint='transfotype')
 @nstf.response(404, 'Transformation type not found')
 class OneTransfoType(Resource):
 
+    tables = ('transfo_type',)
+
     @nstf.marshal_with(transfotype_model)
+    @nstf.doc(params=object_params)
     def get(self, id):
         '''Get one transformation type given its identifier'''
         res = Database.query_asjson(
-            "select * from li3ds.transfo_type where id=%s", (id,)
+            "select {} from li3ds.transfo_type where id=%s"
+            .format(select_list(transfotype_model)), (id,)
         )
         if not res:
             nstf.abort(404, 'Transformation type not found')
@@ -133,6 +207,7 @@ class OneTransfoType(Resource):
 
     @api.secure
     @nstf.response(410, 'Transformation type deleted')
+    @after_write(calibrations.invalidate)
     def delete(self, id):
         '''Delete a transformation type given its identifier'''
         res = Database.rowcount("delete from li3ds.transfo_type where id=%s", (id,))
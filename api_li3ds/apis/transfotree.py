@@ -1,8 +1,13 @@
 # -*- coding: utf-8 -*-
 from flask_restplus import fields
 
-from api_li3ds.app import api, Resource, defaultpayload
+from api_li3ds.app import (
+    api, Resource, defaultpayload, paginate, collection_params, object_params, select_list,
+    after_write, by_ids, ids_model
+)
 from api_li3ds.database import Database
+from api_li3ds.graph import graphs
+from .itowns import calibrations
 
 nstft = api.namespace('transfotrees', description='transformation trees related operations')
 
@@ -27,15 +32,21 @@ transfotree_model = nstft.inherit(
 @nstft.route('/', endpoint='transfotrees')
 class TransfoTree(Resource):
 
+    tables = ('transfo_tree',)
+
     @nstft.marshal_with(transfotree_model)
+    @nstft.doc(params=collection_params)
     def get(self):
         '''List all transformation trees'''
-        return Database.query_asjson("select * from li3ds.transfo_tree")
+        return paginate(
+            "select {} from li3ds.transfo_tree"
+            .format(select_list(transfotree_model)), transfotree_model)
 
     @api.secure
     @nstft.expect(transfotree_model_post)
     @nstft.marshal_with(transfotree_model)
     @nstft.response(201, 'Transformation created')
+    @after_write(graphs.invalidate, calibrations.invalidate)
     def post(self):
         '''Create a transformation between referentials'''
         return Database.query_asdict(
@@ -49,15 +60,32 @@ class TransfoTree(Resource):
         ), 201
 
 
+@nstft.route('/lookup/', endpoint='transfotrees_lookup')
+class LookupTransfoTrees(Resource):
+
+    @nstft.expect(ids_model)
+    @nstft.marshal_with(transfotree_model, as_list=True)
+    @nstft.response(413, 'Too many identifiers')
+    def post(self):
+        '''Get transformation trees given their identifiers, in the same order.
+        Same as the ids parameter, for long lists
+        '''
+        return by_ids("select * from li3ds.transfo_tree", api.payload['ids'])
+
+
 @nstft.route('/<int:id>/', endpoint='transfotree')
 @nstft.response(404, 'Transformation tree not found')
 class OneTransfoTree(Resource):
 
+    tables = ('transfo_tree',)
+
     @nstft.marshal_with(transfotree_model)
+    @nstft.doc(params=object_params)
     def get(self, id):
         '''Get one transformation given its identifier'''
         res = Database.query_asjson(
-            "select * from li3ds.transfo_tree where id=%s", (id,)
+            "select {} from li3ds.transfo_tree where id=%s"
+            .format(select_list(transfotree_model)), (id,)
         )
         if not res:
             nstft.abort(404, 'Transformation tree not found')
@@ -65,6 +93,7 @@ class OneTransfoTree(Resource):
 
     @api.secure
     @nstft.response(410, 'Transformation deleted')
+    @after_write(graphs.invalidate, calibrations.invalidate)
     def delete(self, id):
         '''Delete a transformation given its identifier'''
         res = Database.rowcount("delete from li3ds.transfo_tree where id=%s", (id,))
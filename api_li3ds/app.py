@@ -1,18 +1,144 @@
 # -*- coding: utf-8 -*-
+from json import loads
 from functools import wraps
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 
-from flask import request, current_app
-from flask_restplus import Api, Resource as OrigResource
+from flask import request, current_app, has_app_context, Response, stream_with_context, url_for
+from flask_restplus import Api, Namespace, Resource as OrigResource, marshal, fields
+from flask_restplus import marshal_with as OrigMarshalWith
+from flask_restplus.utils import merge, unpack
+from werkzeug.wrappers import BaseResponse
+from jsonschema import Draft4Validator
 
-from api_li3ds.database import pgexceptions
+from api_li3ds.database import Database, pgexceptions
+from api_li3ds.cache import content_key
+from api_li3ds.changes import changes
+from api_li3ds import passthrough
+from api_li3ds.encoder import dumps, output_json
+from api_li3ds.compression import Payload
+from api_li3ds.memo import Memo
 
 HEADER_API_KEY = 'X-API-KEY'
 
+# bodies of GET responses by generation ETag (and url root, for links)
+payloads = Memo('payload_cache_ttl', 3600, maxsize=64)
+
 
 class Resource(OrigResource):
     # add a postgresql exception decorator for all api methods
     method_decorators = [pgexceptions]
+    # li3ds tables the GET responses are built from, their generations
+    # give the ETag without running the queries. Writes to the resource
+    # disable these ETags until their notification is received
+    tables = ()
+
+    def dispatch_request(self, *args, **kwargs):
+        '''Adds an ETag to GET responses and answers 304 Not Modified
+        when it matches If-None-Match
+        '''
+        if request.method not in ('GET', 'HEAD'):
+            before = changes.snapshot(self.tables)
+            resp = super().dispatch_request(*args, **kwargs)
+            code = resp.status_code if isinstance(resp, BaseResponse) else unpack(resp)[1]
+            if code < 400:
+                # read your writes: no generation ETag nor cached payload
+                # for these tables until the change is notified
+                changes.written(before)
+            return resp
+        etag = generation_etag(self.tables)
+        if etag is not None:
+            if request.if_none_match.contains_weak(etag):
+                resp = Response(status=304)
+                resp.set_etag(etag)
+                return resp
+            payload = payloads.lookup((etag, request.url_root))
+            if payload is not None:
+                resp = payload.response()
+                resp.set_etag(etag)
+                return resp
+        resp = super().dispatch_request(*args, **kwargs)
+        if not isinstance(resp, BaseResponse):
+            data, code, headers = unpack(resp)
+            resp = self.api.make_response(data, code, headers=headers)
+        if resp.status_code != 200 or 'ETag' in resp.headers:
+            return resp
+        if etag is not None:
+            if not resp.is_streamed and 'Content-Encoding' not in resp.headers:
+                # stored with its compressed variants until a table changes
+                payload = Payload(resp.get_data(), resp.mimetype, [
+                    (name, value) for name, value in resp.headers
+                    if name not in ('Content-Type', 'Content-Length')
+                ])
+                payloads.store((etag, request.url_root), payload)
+                resp = payload.response()
+            resp.set_etag(etag)
+        elif resp.is_streamed:
+            return resp
+        else:
+            # hash of the body when tables generations are unknown
+            resp.add_etag()
+        return resp.make_conditional(request)
+
+
+def generation_etag(tables):
+    '''Returns an ETag for the current request made from the generations
+    of the given tables, or None if they are not known (pg_notify disabled)
+    '''
+    if not tables or not changes.active:
+        return None
+    if 'expand' in request.args:
+        # related objects come from other tables
+        return None
+    if any(changes.pending(table) for table in tables):
+        return None
+    return content_key(
+        request.full_path,
+        request.headers.get(current_app.config['RESTPLUS_MASK_HEADER']),
+        str(request.accept_mimetypes),
+        [(table, changes.generation(table)) for table in tables],
+    )
+
+
+class marshal_with(OrigMarshalWith):
+    '''Same as the restplus marshal_with decorator but responses
+    already built by the method (streams...) are returned untouched
+    '''
+
+    def __call__(self, f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            resp = f(*args, **kwargs)
+            if isinstance(resp, BaseResponse):
+                return resp
+            mask = self.mask
+            if has_app_context():
+                mask_header = current_app.config['RESTPLUS_MASK_HEADER']
+                mask = request.headers.get(mask_header) or mask
+                if request.method == 'GET' and 'fields' in request.args:
+                    mask = ','.join(requested_fields(self.fields))
+            if isinstance(resp, tuple):
+                data, code, headers = unpack(resp)
+                return marshal(data, self.fields, self.envelope, mask), code, headers
+            return marshal(resp, self.fields, self.envelope, mask)
+        return wrapper
+
+
+class Li3dsNamespace(Namespace):
+
+    def marshal_with(self, fields, as_list=False, code=200, description=None, **kwargs):
+        '''
+        A decorator specifying the fields to use for serialization.
+        '''
+        def wrapper(func):
+            doc = {
+                'responses': {
+                    code: (description, [fields]) if as_list else (description, fields)
+                },
+                '__mask__': kwargs.get('mask', True),
+            }
+            func.__apidoc__ = merge(getattr(func, '__apidoc__', {}), doc)
+            return marshal_with(fields, **kwargs)(func)
+        return wrapper
 
 
 def defaultpayload(payload):
@@ -24,11 +150,330 @@ def defaultpayload(payload):
     return newpayload
 
 
+def after_write(*callbacks):
+    '''Calls the given callbacks (cache invalidation...)
+    once the decorated method succeeded
+    '''
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            res = func(*args, **kwargs)
+            for callback in callbacks:
+                callback()
+            return res
+        return wrapper
+    return decorator
+
+
+def bulk_payload(model):
+    '''Returns the objects posted as a json array or as newline
+    delimited json (application/x-ndjson), each one being validated
+    against the model and wrapped with defaultpayload
+    '''
+    if request.mimetype == 'application/x-ndjson':
+        try:
+            data = [
+                loads(line)
+                for line in request.get_data(as_text=True).splitlines()
+                if line.strip()
+            ]
+        except ValueError:
+            api.abort(400, 'Invalid NDJSON payload')
+    else:
+        data = request.get_json()
+        if not isinstance(data, list):
+            api.abort(400, 'A json array is expected')
+
+    maxitems = current_app.config.get('bulk_max_items', 10000)
+    if len(data) > maxitems:
+        api.abort(413, 'Too many items (maximum is {})'.format(maxitems))
+
+    validator = Draft4Validator(
+        model.__schema__, resolver=api.refresolver, format_checker=api.format_checker)
+    errors = {}
+    for idx, obj in enumerate(data):
+        for error in validator.iter_errors(obj):
+            key, message = model.format_error(error)
+            errors['.'.join(filter(None, (str(idx), key)))] = message
+    if errors:
+        api.abort(400, 'Input payload validation failed', errors=errors)
+
+    return [defaultpayload(obj) for obj in data]
+
+
+def streaming(parameter='stream'):
+    '''Returns True if the client asked for a streamed response
+    '''
+    return request.args.get(parameter, '').lower() in ('1', 'true', 'yes')
+
+
+def stream_json(rows, mimetype='application/json'):
+    '''Build a chunked json array response from an iterator of objects,
+    each one being encoded separately so that memory usage
+    does not depend on the number of rows
+    '''
+    settings = current_app.config.get('RESTPLUS_JSON', {})
+
+    def generate():
+        yield '['
+        separator = ''
+        for row in rows:
+            yield separator + dumps(row, **settings)
+            separator = ','
+        yield ']\n'
+
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+
+def stream_marshal(rows, model):
+    '''Same as stream_json with each row marshalled with the model
+    (restricted to the fields parameter)
+    '''
+    names = requested_fields(model)
+    mask = ','.join(names) if names else None
+    return stream_json(marshal(row, model, mask=mask) for row in rows)
+
+
+def stream_ndjson(rows):
+    '''Build a chunked newline delimited json response (one object per line)
+    '''
+    def generate():
+        for row in rows:
+            yield dumps(row) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def stream_geojson(features):
+    '''Build a chunked GeoJSON FeatureCollection response
+    from an iterator of features
+    '''
+    def generate():
+        yield '{"type": "FeatureCollection", "features": ['
+        separator = ''
+        for feature in features:
+            yield separator + dumps(feature)
+            separator = ','
+        yield ']}\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/geo+json')
+
+
+# response formats by mimetype
+FORMATS = {
+    'application/json': 'json',
+    'application/x-ndjson': 'ndjson',
+    'application/geo+json': 'geojson',
+    'application/vnd.geo+json': 'geojson',
+    'application/octet-stream': 'binary',
+}
+
+
+def output_format(formats=('json', 'ndjson', 'geojson')):
+    '''Returns the response format asked with the format parameter
+    or else with the Accept header, json by default
+    '''
+    if 'format' in request.args:
+        fmt = request.args['format']
+        if fmt not in formats:
+            api.abort(400, 'format must be one of {}'.format(', '.join(formats)))
+        return fmt
+    mimetypes = [mimetype for mimetype, fmt in FORMATS.items() if fmt in formats]
+    best = request.accept_mimetypes.best_match(sorted(mimetypes), default='application/json')
+    if request.accept_mimetypes[best] <= request.accept_mimetypes['application/json']:
+        return 'json'
+    return FORMATS[best]
+
+
+# query parameters accepted by collection resources
+collection_params = {
+    'limit': 'maximum number of items returned (bounded by the server)',
+    'after': 'only return items whose identifier is greater than this cursor',
+    'stream': 'stream results as they are read from the database',
+    'fields': 'comma separated list of the fields returned',
+    'ids': 'comma separated list of identifiers, objects are returned in this order '
+           'and missing ones are given in the X-Missing-Ids header (the first '
+           'missing_ids_max ones) and counted in the X-Missing-Count header',
+}
+
+# query parameters accepted by single object resources
+object_params = {
+    'fields': 'comma separated list of the fields returned',
+}
+
+
+def requested_fields(model):
+    '''Returns the names of the model fields asked with the fields
+    parameter in the order of the model, None if it is not given.
+    Each subset of fields thus gives a single select list and mask
+    '''
+    if 'fields' not in request.args:
+        return None
+    asked = set(name.strip() for name in request.args['fields'].split(','))
+    asked.discard('')
+    known = getattr(model, 'resolved', model)
+    unknown = asked.difference(known)
+    if unknown:
+        api.abort(400, 'Unknown fields: {}'.format(', '.join(sorted(unknown))),
+                  errors={'fields': 'must be among {}'.format(', '.join(known))})
+    if not asked:
+        api.abort(400, 'fields cannot be empty')
+    return [name for name in known if name in asked]
+
+
+def select_list(model, alias=None, key='id'):
+    '''Returns the SQL select list of the columns of the fields asked
+    with the fields parameter, all the columns by default.
+    The ``key`` column is always selected, for pagination
+    '''
+    prefix = '{}.'.format(alias) if alias else ''
+    names = requested_fields(model)
+    if names is None:
+        return prefix + '*'
+    if key and key not in names:
+        known = getattr(model, 'resolved', model)
+        names = [name for name in known if name == key or name in names]
+        if key not in names:
+            names.insert(0, key)
+    return ', '.join('{}"{}"'.format(prefix, name) for name in names)
+
+
+def page_args():
+    '''Returns the page size and cursor given in the query string.
+    Page size is bounded by the page_size_max setting
+    and is not set by default for streamed responses
+    '''
+    maxsize = current_app.config.get('page_size_max', 1000)
+    limit = request.args.get('limit', type=positive_int)
+    after = request.args.get('after', type=int)
+    if limit is None and 'limit' in request.args:
+        api.abort(400, 'limit must be a positive integer')
+    if after is None and 'after' in request.args:
+        api.abort(400, 'after must be an integer')
+    if limit is None and not streaming():
+        limit = maxsize
+    if limit is not None:
+        limit = min(limit, maxsize)
+    return limit, after
+
+
+def positive_int(value):
+    value = int(value)
+    if value <= 0:
+        raise ValueError('{} is not a positive integer'.format(value))
+    return value
+
+
+def use_passthrough(model):
+    '''Returns True if the json document for this model can be
+    built by postgres and sent as is (json_passthrough setting)
+    '''
+    if not current_app.config.get('json_passthrough', False):
+        return False
+    if request.headers.get(current_app.config['RESTPLUS_MASK_HEADER']):
+        return False
+    return passthrough.supported(model, requested_fields(model))
+
+
+def json_document(document, code=200, headers=None):
+    '''Response for a json document already serialized'''
+    return Response(document + '\n', code, headers, mimetype='application/json')
+
+
+def json_payload(data):
+    '''Payload of a json document, for caches keeping compressed variants'''
+    return Payload((dumps(data) + '\n').encode('utf-8'))
+
+
+def paginate(query, model, parameters=None):
+    '''Run a collection query one page at a time with a keyset
+    pagination on the id column (no offset scan).
+
+    The url of the next page is given in a Link header
+    and its cursor in a X-Next-Cursor header.
+    ``parameters`` must be a dict if given.
+    '''
+    if 'ids' in request.args:
+        return by_ids(query, ids_arg(), parameters)
+
+    limit, after = page_args()
+    parameters = dict(parameters or {}, limit=limit, after=after)
+    if after is not None:
+        query = "select * from ({}) as t where id > %(after)s".format(query)
+    query = "{} order by id limit %(limit)s".format(query)
+
+    if streaming():
+        return stream_marshal(Database.query_asjson_stream(query, parameters), model)
+
+    fast = use_passthrough(model)
+    if fast:
+        res = Database.query_asjson_document(
+            query, passthrough.json_object(model, requested_fields(model)),
+            parameters, cursor='id')
+        rows, count, cursor = res.document, res.count, res.cursor
+    else:
+        rows = Database.query_asjson(query, parameters)
+        count, cursor = len(rows), (rows[-1]['id'] if rows else None)
+
+    headers = {}
+    if limit is not None and count == limit:
+        args = dict(request.view_args)
+        args.update(request.args.to_dict())
+        args.update(limit=limit, after=cursor)
+        headers['Link'] = '<{}>; rel="next"'.format(
+            url_for(request.endpoint, _external=True, **args))
+        headers['X-Next-Cursor'] = str(cursor)
+    if fast:
+        return json_document(rows, 200, headers)
+    return rows, 200, headers
+
+
+def ids_arg():
+    '''Returns the identifiers given in the ids parameter'''
+    try:
+        return [int(value) for value in request.args['ids'].split(',') if value.strip()]
+    except ValueError:
+        api.abort(400, 'ids must be a comma separated list of integers')
+
+
+def by_ids(query, ids, parameters=None):
+    '''Run a collection query for the given identifiers only.
+    Objects are returned in the order of the identifiers, repeated if
+    an identifier is. The ones not found are counted in a X-Missing-Count
+    header and listed in a X-Missing-Ids header, bounded by the
+    missing_ids_max setting (X-Missing-Ids-Truncated is set if it is
+    exceeded) so that it fits in the proxies header buffers.
+    ``parameters`` must be a dict if given.
+    '''
+    maxitems = current_app.config.get('bulk_max_items', 10000)
+    if len(ids) > maxitems:
+        api.abort(413, 'Too many identifiers (maximum is {})'.format(maxitems))
+    rows = Database.query_asjson(
+        "select * from ({}) as t where id = any(%(ids)s)".format(query),
+        dict(parameters or {}, ids=ids))
+    found = {row['id']: row for row in rows}
+    headers = {}
+    missing = [str(id) for id in OrderedDict.fromkeys(ids) if id not in found]
+    if missing:
+        maxmissing = current_app.config.get('missing_ids_max', 100)
+        headers['X-Missing-Count'] = str(len(missing))
+        headers['X-Missing-Ids'] = ','.join(missing[:maxmissing])
+        if len(missing) > maxmissing:
+            headers['X-Missing-Ids-Truncated'] = 'true'
+    return [found[id] for id in ids if id in found], 200, headers
+
+
 class Li3dsApi(Api):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
+    def namespace(self, *args, **kwargs):
+        '''Namespace factory using our own namespace class'''
+        ns = Li3dsNamespace(*args, **kwargs)
+        self.add_namespace(ns)
+        return ns
+
     def secure(self, func):
         '''Enforce authentication'''
 
@@ -58,6 +503,11 @@ api = Li3dsApi(
         }
     }
 )
+api.representation('application/json')(output_json)
+
+ids_model = api.model('Identifiers', {
+    'ids': fields.List(fields.Integer, required=True),
+})
 
 
 def init_apis():
@@ -71,3 +521,4 @@ def init_apis():
     from api_li3ds.apis.referential import nsrf
     from api_li3ds.apis.transfo import nstf
     from api_li3ds.apis.transfotree import nstft
+    from api_li3ds.apis.monitoring import nsmonitoring
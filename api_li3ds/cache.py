@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+'''
+Content addressed caches stored on local disk.
+
+Entries are files named after their key, written atomically so that
+several uwsgi workers can share the same directory. When the total size
+goes over the limit the least recently used entries are removed.
+'''
+import os
+import tempfile
+from hashlib import sha1
+from threading import Lock
+
+from flask import current_app
+
+_caches = {}
+_lock = Lock()
+
+
+def content_key(*parts):
+    '''
+    Returns a hash identifying the given content
+    '''
+    digest = sha1()
+    for part in parts:
+        digest.update(repr(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class DiskCache():
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        '''
+        Returns the cached data or None
+        '''
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as fp:
+                data = fp.read()
+        except FileNotFoundError:
+            return None
+        try:
+            # the modification time is used as last access time
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return data
+
+    def set(self, key, data):
+        '''
+        Stores data and evicts old entries if needed
+        '''
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(data)
+            os.replace(tmp, self._path(key))
+        except OSError:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        self.evict()
+
+    def evict(self):
+        '''
+        Removes the least recently used entries until
+        the cache size is under its limit
+        '''
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if name.startswith('.tmp'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def disk_cache(name, default_size=50 * 1024 * 1024):
+    '''
+    Returns the disk cache with the given name, stored in the
+    cache_dir setting and limited by the <name>_cache_size setting (bytes)
+    '''
+    with _lock:
+        if name not in _caches:
+            directory = os.path.join(
+                current_app.config.get(
+                    'cache_dir', os.path.join(tempfile.gettempdir(), 'api_li3ds')),
+                name)
+            _caches[name] = DiskCache(
+                directory, current_app.config.get('{}_cache_size'.format(name), default_size))
+        return _caches[name]
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+'''
+Changes made to the li3ds schema tables, notified by postgres.
+
+The triggers installed by sql/notify.sql record each change with a new
+generation and send it on the li3ds_<table> channel. A background thread
+of each process listens to these channels, keeps the last generation of
+each table and calls the callbacks subscribed to the modified table, so
+that caches see the writes of other workers, nodes or loaders.
+'''
+import os
+import select
+from time import monotonic
+from collections import defaultdict
+from threading import Thread, Lock, Event
+
+from psycopg2 import connect, Error as PsycoError
+
+CHANNEL_PREFIX = 'li3ds_'
+
+# detect connections dropped without notice (failover, firewalls...)
+KEEPALIVES = 'keepalives=1&keepalives_idle=30&keepalives_interval=10&keepalives_count=3'
+
+# seconds a table written by this process waits for its notification
+PENDING_TTL = 60
+
+# seconds between the deletions of the changes superseded in li3ds.table_change
+PRUNE_INTERVAL = 300
+
+
+class ChangeListener():
+
+    def __init__(self):
+        self._generations = {}
+        self._pending = {}
+        self._callbacks = defaultdict(list)
+        self._lock = Lock()
+        self._stopped = Event()
+        self._thread = None
+        self._pid = None
+        self._connected = False
+        self._alive = 0
+        self._pruned = 0
+        self.dsn = None
+        self.logger = None
+        self.timeout = 5
+
+    @property
+    def active(self):
+        '''
+        True if the generations are up to date: the listener is connected
+        and the server answered recently
+        '''
+        return self._connected and monotonic() - self._alive < 3 * self.timeout
+
+    def init_app(self, app):
+        '''
+        Starts listening on the first request of each process
+        (threads do not survive forks) if the pg_notify setting is set
+        '''
+        if not app.config.get('pg_notify', False):
+            return
+        self.dsn = (
+            "postgresql://{pg_user}:{pg_password}@{pg_host}:{pg_port}/{pg_name}?{keepalives}"
+            .format(keepalives=KEEPALIVES, **app.config))
+        self.logger = app.logger
+        app.before_request(self.start)
+
+    def start(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._connected = False
+            self._stopped.clear()
+            self._thread = Thread(target=self._run, name='li3ds-changes', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def subscribe(self, callback, *tables):
+        '''
+        Calls callback (without arguments) when one of the tables is modified
+        '''
+        with self._lock:
+            for table in tables:
+                self._callbacks[table].append(callback)
+
+    def generation(self, table):
+        '''
+        Last known generation of a table (0 if unknown)
+        '''
+        with self._lock:
+            return self._generations.get(table, 0)
+
+    def generations(self):
+        with self._lock:
+            return dict(self._generations)
+
+    def snapshot(self, tables):
+        '''
+        Generations of the tables before a write
+        '''
+        with self._lock:
+            return {table: self._generations.get(table, 0) for table in tables}
+
+    def written(self, snapshot):
+        '''
+        Marks the tables of a snapshot as written by this process: their
+        generation is not known until a newer one is notified
+        '''
+        with self._lock:
+            for table, generation in snapshot.items():
+                if self._generations.get(table, 0) == generation:
+                    self._pending[table] = (generation, monotonic())
+
+    def pending(self, table):
+        '''
+        True if a write of this process to the table is not notified yet
+        '''
+        with self._lock:
+            if table not in self._pending:
+                return False
+            generation, since = self._pending[table]
+            if self._generations.get(table, 0) != generation or monotonic() - since > PENDING_TTL:
+                del self._pending[table]
+                return False
+            return True
+
+    def changed(self, table, generation):
+        '''
+        Records the generation of a table, calls its callbacks if it is new
+        '''
+        with self._lock:
+            if self._generations.get(table) == generation:
+                return
+            self._generations[table] = generation
+            callbacks = list(self._callbacks.get(table, ()))
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                if self.logger:
+                    self.logger.exception('change callback failed for table %s', table)
+
+    def _listen(self, conn):
+        with conn.cursor() as cur:
+            cur.execute("""
+                select distinct event_object_table from information_schema.triggers
+                where trigger_schema = 'li3ds' and trigger_name = 'li3ds_notify'
+                """)
+            for table, in cur.fetchall():
+                cur.execute('listen "{}{}"'.format(CHANNEL_PREFIX, table))
+            # read after listening: changes committed in between are not missed
+            cur.execute("""
+                select table_name, max(generation) from li3ds.table_change
+                group by table_name
+                """)
+            tables = cur.fetchall()
+        for table, generation in tables:
+            self.changed(table, generation)
+        self._alive = monotonic()
+        self._connected = True
+        self._prune(conn)
+
+    def _prune(self, conn):
+        '''
+        Deletes the changes older than the last one of their table
+        '''
+        with conn.cursor() as cur:
+            cur.execute("""
+                delete from li3ds.table_change c
+                using (
+                    select table_name, max(generation) as generation
+                    from li3ds.table_change group by table_name
+                ) as last
+                where c.table_name = last.table_name and c.generation < last.generation
+                """)
+        self._pruned = monotonic()
+
+    def _ping(self, conn):
+        '''
+        Checks that the server still answers, the notifications received
+        meanwhile are queued in conn.notifies
+        '''
+        with conn.cursor() as cur:
+            cur.execute('select 1')
+        self._alive = monotonic()
+        if self._alive - self._pruned > PRUNE_INTERVAL:
+            self._prune(conn)
+
+    def _run(self):
+        delay = 1
+        while not self._stopped.is_set():
+            conn = None
+            try:
+                conn = connect(self.dsn)
+                conn.autocommit = True
+                self._listen(conn)
+                delay = 1
+                while not self._stopped.is_set():
+                    if select.select([conn], [], [], self.timeout) == ([], [], []):
+                        self._ping(conn)
+                    else:
+                        conn.poll()
+                        self._alive = monotonic()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        self.changed(notify.channel[len(CHANNEL_PREFIX):], int(notify.payload))
+            except (PsycoError, OSError) as exc:
+                self._connected = False
+                if self.logger:
+                    self.logger.warning('change listener disconnected: %s', exc)
+                self._stopped.wait(delay)
+                delay = min(delay * 2, 60)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+
+changes = ChangeListener()
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+'''
+Compression of responses negotiated with the Accept-Encoding header.
+
+Responses are compressed with brotli (``pip install api_li3ds[fast]``)
+or gzip when the client accepts it, their type is worth compressing and
+they are larger than the compression_min_size setting. Streamed responses
+are compressed as they are produced.
+
+Cached bodies are kept with their compressed variants (Payload objects
+in memory, variant entries in disk caches) so that they are compressed
+once per change rather than on each request.
+'''
+import zlib
+
+from flask import current_app, request, Response
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+# content codings supported, preferred first
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+# types that are not already compressed (images...)
+COMPRESSIBLE = {
+    'application/json',
+    'application/x-ndjson',
+    'application/geo+json',
+    'application/vnd.geo+json',
+    'application/octet-stream',
+    'application/javascript',
+    'image/svg+xml',
+}
+
+
+def compressible(mimetype):
+    return mimetype in COMPRESSIBLE or (mimetype or '').startswith('text/')
+
+
+def negotiate():
+    '''
+    Returns the content coding to use for the current request
+    (the one with the best quality in Accept-Encoding), None for identity
+    '''
+    best, quality = None, 0
+    for encoding in current_app.config.get('compression_encodings', ENCODINGS):
+        if encoding not in ENCODINGS:
+            continue
+        if request.accept_encodings[encoding] > quality:
+            best, quality = encoding, request.accept_encodings[encoding]
+    return best
+
+
+def min_size():
+    return current_app.config.get('compression_min_size', 1024)
+
+
+def compressor(encoding):
+    '''
+    Returns the compress and flush functions of a streaming compressor
+    whose level is given by the compression_<encoding>_level setting
+    '''
+    if encoding == 'br':
+        comp = brotli.Compressor(
+            quality=current_app.config.get('compression_br_level', 4))
+        return comp.process, comp.finish
+    # wbits 31 gives a gzip header and trailer
+    comp = zlib.compressobj(
+        current_app.config.get('compression_gzip_level', 6), zlib.DEFLATED, 31)
+    return comp.compress, comp.flush
+
+
+def compress(data, encoding):
+    compress_, flush = compressor(encoding)
+    return compress_(data) + flush()
+
+
+def compress_stream(chunks, encoding):
+    compress_, flush = compressor(encoding)
+    for chunk in chunks:
+        data = compress_(chunk)
+        if data:
+            yield data
+    yield flush()
+
+
+class Payload():
+    '''
+    A response body kept by a cache, each compressed variant
+    being computed on the first request asking for it
+    '''
+
+    def __init__(self, data, mimetype='application/json', headers=None):
+        self.data = data
+        self.mimetype = mimetype
+        self.headers = list(headers or [])
+        self._variants = {}
+
+    def body(self, encoding):
+        if encoding is None:
+            return self.data
+        if encoding not in self._variants:
+            # concurrent requests may both compress, the result is the same
+            self._variants[encoding] = compress(self.data, encoding)
+        return self._variants[encoding]
+
+    def response(self, status=200):
+        encoding = None
+        if compressible(self.mimetype) and len(self.data) >= min_size():
+            encoding = negotiate()
+        response = Response(self.body(encoding), status, self.headers, mimetype=self.mimetype)
+        response.vary.add('Accept-Encoding')
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        return response
+
+
+def cached_response(cache, key, build, mimetype='application/json'):
+    '''
+    Response for a body stored in a disk cache under key, build() being
+    called if it is missing. Compressed variants are stored next to it
+    '''
+    encoding = negotiate() if compressible(mimetype) else None
+    data = None
+    if encoding is not None:
+        data = cache.get('{}.{}'.format(key, encoding))
+    if data is None:
+        data = cache.get(key)
+        if data is None:
+            data = build()
+            cache.set(key, data)
+        if encoding is not None and len(data) >= min_size():
+            data = compress(data, encoding)
+            cache.set('{}.{}'.format(key, encoding), data)
+        else:
+            encoding = None
+    response = Response(data, mimetype=mimetype)
+    response.vary.add('Accept-Encoding')
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+class Compression():
+
+    def init_app(self, app):
+        app.after_request(self.after_request)
+
+    def after_request(self, response):
+        '''
+        Compresses the response if the client accepts it
+        '''
+        if 'Content-Encoding' not in response.headers:
+            self.compress(response)
+        if 'Content-Encoding' in response.headers:
+            # the body is not the one the strong validator was computed on
+            etag, weak = response.get_etag()
+            if etag and not weak:
+                response.set_etag(etag, weak=True)
+        return response
+
+    def compress(self, response):
+        if response.status_code < 200 or response.status_code in (204, 206, 304):
+            return
+        if response.direct_passthrough or not compressible(response.mimetype):
+            return
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate()
+        if encoding is None:
+            return
+        if response.is_streamed:
+            response.response = compress_stream(response.iter_encoded(), encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < min_size():
+                return
+            response.set_data(compress(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+
+
+compression = Compression()
@@ -1,24 +1,40 @@
 # -*- coding: utf-8 -*-
-from itertools import chain
+import os
+from itertools import chain, count
 from functools import wraps
+from contextlib import contextmanager
+from collections import deque, Counter
+from threading import Condition
+from time import monotonic
 
 from psycopg2 import connect
 from psycopg2.extras import NamedTupleCursor, Json
 from psycopg2 import Error as PsycoError
-from psycopg2.extensions import register_adapter
+from psycopg2.pool import PoolError
+from psycopg2.extensions import register_adapter, encodings, TRANSACTION_STATUS_IDLE
 
-from flask import current_app
+from flask import current_app, g
 from flask_restplus import abort
 
+from api_li3ds import statements
+from api_li3ds.metrics import metrics
+from api_li3ds.slowlog import slowlog
+
 # adapt python dict to postgresql json type
 register_adapter(dict, Json)
 
+# unique names for server side cursors
+cursor_names = count()
+
 
 def pgexceptions(func):
     @wraps(func)
     def decorated(*args, **kwargs):
         try:
             return func(*args, **kwargs)
+        except PoolTimeout as exc:
+            current_app.logger.error(exc.args[0])
+            return abort(503, 'Database busy')
         except PsycoError as exc:
             current_app.logger.error(exc.pgerror or exc.args)
             if current_app.debug:
@@ -29,22 +45,225 @@ def pgexceptions(func):
     return decorated
 
 
+class PoolTimeout(PoolError):
+    '''
+    Raised when no connection can be checked out before the pool timeout
+    '''
+
+
+class ConnectionPool():
+    '''
+    Thread-safe pool of psycopg2 connections.
+
+    ``minconn`` connections are opened upfront and always kept, others are
+    opened on demand up to ``maxconn`` and closed after ``max_idle`` seconds
+    of inactivity. A checkout waits at most ``timeout`` seconds for a free
+    connection. Connections idle for more than ``check_interval`` seconds
+    are pinged before being handed out.
+    '''
+
+    def __init__(self, dsn, minconn=1, maxconn=10, timeout=30,
+                 check_interval=30, max_idle=300, **kwargs):
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self.max_idle = max_idle
+        self.kwargs = kwargs
+        self._cond = Condition()
+        self._stats = Counter()
+        self._reset()
+        for _ in range(minconn):
+            self._opened += 1
+            self._stats['connections'] += 1
+            self._idle.append((self._connect(), monotonic()))
+
+    def _reset(self):
+        # connections inherited from a parent process are not ours to use
+        self._pid = os.getpid()
+        self._idle = deque()
+        self._opened = 0
+
+    def _connect(self):
+        conn = connect(self.dsn, **self.kwargs)
+        # autocommit mode for performance (we don't need transaction)
+        conn.autocommit = True
+        return conn
+
+    def _healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if monotonic() - last_used < self.check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('select 1')
+        except PsycoError:
+            return False
+        return True
+
+    def _discard(self, conn):
+        if not conn.closed:
+            conn.close()
+
+    def getconn(self):
+        '''
+        Check out a connection, waiting for a free one if needed
+        '''
+        start = monotonic()
+        deadline = start + self.timeout
+        with self._cond:
+            if self._pid != os.getpid():
+                self._reset()
+            while True:
+                if self._idle:
+                    # most recently used first, it is the most likely alive
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._opened < self.maxconn:
+                    self._opened += 1
+                    conn, last_used = None, None
+                    break
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(
+                        'no database connection available after {}s'
+                        .format(self.timeout))
+                self._cond.wait(remaining)
+            waited = monotonic() - start
+            self._stats['checkouts'] += 1
+            self._stats['wait_time'] += waited
+            self._stats['max_wait_time'] = max(self._stats['max_wait_time'], waited)
+
+        if conn is not None and self._healthy(conn, last_used):
+            return conn
+
+        try:
+            if conn is not None:
+                self._discard(conn)
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._opened -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            if last_used is not None:
+                self._stats['discarded'] += 1
+            self._stats['connections'] += 1
+        return conn
+
+    def putconn(self, conn):
+        '''
+        Give a connection back to the pool
+        '''
+        broken = conn.closed
+        if not broken and conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except PsycoError:
+                broken = True
+        if not broken and not conn.autocommit:
+            conn.autocommit = True
+
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            if broken:
+                self._discard(conn)
+                self._stats['discarded'] += 1
+                self._opened -= 1
+            else:
+                self._idle.append((conn, monotonic()))
+            # close connections above the minimum that have been idle for too long
+            now = monotonic()
+            while len(self._idle) > self.minconn and now - self._idle[0][1] > self.max_idle:
+                self._discard(self._idle.popleft()[0])
+                self._stats['closed'] += 1
+                self._opened -= 1
+            self._cond.notify()
+
+    def closeall(self):
+        '''
+        Close all idle connections
+        '''
+        with self._cond:
+            while self._idle:
+                self._idle.pop()[0].close()
+                self._opened -= 1
+
+    def stats(self):
+        '''
+        Returns a snapshot of the pool usage
+        '''
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'min': self.minconn,
+                'max': self.maxconn,
+                'size': self._opened,
+                'idle': len(self._idle),
+                'used': self._opened - len(self._idle),
+            })
+        return stats
+
+
 class Database():
     '''
-    Database object used as a global connection object to the db
+    Database object giving access to the connection pool.
+
+    A connection is checked out on the first query of a request
+    and given back to the pool on teardown.
     '''
-    db = None
+    pool = None
+
+    @classmethod
+    def connection(cls):
+        '''
+        Returns the connection bound to the current request
+        '''
+        if 'li3ds_db' not in g:
+            start = monotonic()
+            g.li3ds_db = cls.pool.getconn()
+            metrics.observe('li3ds_pool_wait_seconds', monotonic() - start)
+        return g.li3ds_db
+
+    @classmethod
+    def release(cls, exc=None):
+        '''
+        Give the connection of the current request back to the pool
+        '''
+        conn = g.pop('li3ds_db', None)
+        if conn is not None:
+            cls.pool.putconn(conn)
+
+    @classmethod
+    def pool_stats(cls):
+        return cls.pool.stats()
+
+    @classmethod
+    def statement_stats(cls):
+        return statements.statement_stats()
 
     @classmethod
     def _query(cls, query, parameters=None, rowcount=None):
         '''
         Performs a query and returns results as a named tuple
         '''
-        cur = cls.db.cursor()
-        cur.execute(query, parameters)
-        current_app.logger.debug(
-            'query: {}, rowncount: {}'.format(query, cur.rowcount)
-        )
+        cur = cls.connection().cursor()
+        size = current_app.config.get('pg_prepared_statements', 100)
+        start = monotonic()
+        if size:
+            statements.execute(cur, query, parameters, size)
+        else:
+            cur.execute(query, parameters)
+        elapsed = monotonic() - start
+        metrics.observe_query(query, elapsed, cur.rowcount)
+        if slowlog.is_slow(elapsed):
+            slowlog.record(cur.connection, query, parameters, elapsed)
+        current_app.logger.debug('query: %s, rowcount: %s', query, cur.rowcount)
         if rowcount:
             yield cur.rowcount
             return
@@ -85,6 +304,120 @@ class Database():
             )
         ]
 
+    @classmethod
+    def insert_many(cls, query, template, rows, page_size=1000):
+        '''
+        Inserts rows in a single transaction with multi rows VALUES statements.
+        ``query`` has a {} placeholder for the values list and returns one column
+        (an identifier), ``template`` is the values tuple of one row.
+        Returns the values of the returned column in the rows order
+        '''
+        conn = cls.connection()
+        conn.autocommit = False
+        ids = []
+        try:
+            with conn.cursor() as cur:
+                for offset in range(0, len(rows), page_size):
+                    page = rows[offset:offset + page_size]
+                    values = b','.join(cur.mogrify(template, row) for row in page)
+                    start = monotonic()
+                    cur.execute(query.format(values.decode(encodings[conn.encoding])))
+                    ids.extend(row[0] for row in cur)
+                    metrics.observe_query(query, monotonic() - start, cur.rowcount)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.autocommit = True
+        return ids
+
+    @classmethod
+    @contextmanager
+    def transaction(cls):
+        '''
+        Runs the queries of the block in a single transaction,
+        committed when the block ends and rolled back on error
+        '''
+        conn = cls.connection()
+        conn.autocommit = False
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.autocommit = True
+
+    @classmethod
+    def query_asjson_document(cls, query, json_object, parameters=None, cursor=None):
+        '''
+        Build a json array in postgres with ``json_object`` applied to each row
+        of the query (named t). Returns a row with the document as text, the number
+        of rows and the greatest value of the ``cursor`` column if given.
+        The array is ordered by the ``cursor`` column since the order of the
+        query is not kept by the aggregate
+        '''
+        if cursor:
+            aggregate = 'json_agg({} order by t.{})'.format(json_object, cursor)
+            greatest = 'max(t.{})'.format(cursor)
+        else:
+            aggregate, greatest = 'json_agg({})'.format(json_object), 'null'
+        return cls.query(
+            "select coalesce({}, '[]')::text as document, count(*) as count, "
+            "{} as cursor from ({}) as t"
+            .format(aggregate, greatest, query),
+            parameters=parameters
+        )[0]
+
+    @classmethod
+    def query_stream(cls, query, parameters=None, fetch_size=None):
+        '''
+        Executes a query with a server side cursor and returns
+        an iterator over results fetched by batches of fetch_size rows
+        '''
+        conn = cls.connection()
+        # server side cursors only live inside a transaction
+        conn.autocommit = False
+        cur = conn.cursor('li3ds_stream_{}'.format(next(cursor_names)))
+        cur.itersize = fetch_size or current_app.config.get('pg_fetch_size', 1000)
+        start = monotonic()
+        try:
+            cur.execute(query, parameters)
+        except PsycoError:
+            conn.rollback()
+            conn.autocommit = True
+            raise
+        current_app.logger.debug('streamed query: %s', query)
+        return cls._stream(conn, cur, query, start)
+
+    @staticmethod
+    def _stream(conn, cur, query, start):
+        rows = 0
+        try:
+            for row in cur:
+                rows += 1
+                yield row
+        finally:
+            metrics.observe_query(query, monotonic() - start, rows)
+            if not conn.closed:
+                conn.rollback()
+                conn.autocommit = True
+
+    @classmethod
+    def query_asjson_stream(cls, query, parameters=None, fetch_size=None):
+        '''
+        Same as query_asjson but rows are streamed from a server side cursor
+        '''
+        return (
+            line[0] for line in
+            cls.query_stream(
+                "select row_to_json(t) from ({}) as t"
+                .format(query), parameters=parameters, fetch_size=fetch_size
+            )
+        )
+
     @classmethod
     def query_aslist(cls, query, parameters=None):
         '''
@@ -103,12 +436,36 @@ class Database():
     @classmethod
     def init_app(cls, app):
         '''
-        Initialize db session lazily
+        Initialize the connection pool and release
+        connections at the end of each request
         '''
-        cls.db = connect(
+        cls.pool = ConnectionPool(
             "postgresql://{pg_user}:{pg_password}@{pg_host}:{pg_port}/{pg_name}"
             .format(**app.config),
+            minconn=app.config.get('pg_pool_min', 1),
+            maxconn=app.config.get('pg_pool_max', 10),
+            timeout=app.config.get('pg_pool_timeout', 30),
+            check_interval=app.config.get('pg_pool_check_interval', 30),
+            max_idle=app.config.get('pg_pool_max_idle', 300),
             cursor_factory=NamedTupleCursor,
+            connection_factory=statements.Li3dsConnection,
         )
-        # autocommit mode for performance (we don't need transaction)
-        cls.db.autocommit = True
+        app.teardown_appcontext(cls.release)
+        metrics.collector(cls.collect_metrics)
+
+    @classmethod
+    def collect_metrics(cls):
+        '''
+        Connection pool and prepared statements metrics
+        '''
+        pool = cls.pool_stats()
+        for key in ('size', 'idle', 'used'):
+            yield ('li3ds_pool_{}'.format(key), 'gauge',
+                   'Database connections {}'.format(key), pool[key])
+        for key in ('connections', 'checkouts', 'timeouts', 'discarded'):
+            yield ('li3ds_pool_{}_total'.format(key), 'counter',
+                   'Database pool {}'.format(key), pool.get(key, 0))
+        stmts = cls.statement_stats()
+        for key in ('hits', 'misses', 'prepares', 'failures', 'evictions'):
+            yield ('li3ds_statements_{}_total'.format(key), 'counter',
+                   'Prepared statements {}'.format(key), stmts.get(key, 0))
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+'''
+JSON encoding of responses.
+
+orjson is used when it is installed (``pip install api_li3ds[fast]``)
+and the json_encoder setting allows it, the standard json module
+otherwise. Both give the same documents for the types returned by
+psycopg2: datetimes in ISO 8601, Decimal as numbers and ranges as
+{"lower", "upper", "bounds"} objects.
+'''
+import json
+from datetime import date, time, timedelta
+from decimal import Decimal
+
+from flask import current_app, has_app_context, make_response
+from psycopg2.extras import Range
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+else:
+    ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def default(obj):
+    '''
+    Encodes the values the json modules do not know
+    '''
+    if isinstance(obj, (date, time)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, timedelta):
+        return obj.total_seconds()
+    if isinstance(obj, Range):
+        if obj.isempty:
+            return {'empty': True}
+        return {'lower': obj.lower, 'upper': obj.upper, 'bounds': obj._bounds}
+    if hasattr(obj, 'tolist'):
+        # numpy arrays and scalars
+        return obj.tolist()
+    raise TypeError('{!r} is not JSON serializable'.format(obj))
+
+
+def use_orjson(settings=None):
+    '''
+    True if orjson is available and enabled by the json_encoder setting
+    (auto by default), settings of the standard encoder (indent...)
+    given with RESTPLUS_JSON are only supported by the json module
+    '''
+    if orjson is None or settings:
+        return False
+    if has_app_context():
+        return current_app.config.get('json_encoder', 'auto') in ('auto', 'orjson')
+    return True
+
+
+def dumps(data, **settings):
+    '''
+    Returns the json document of data as a string
+    '''
+    if use_orjson(settings):
+        return orjson.dumps(data, default=default, option=ORJSON_OPTIONS).decode('utf-8')
+    settings.setdefault('default', default)
+    return json.dumps(data, **settings)
+
+
+def output_json(data, code, headers=None):
+    '''
+    Restplus representation of application/json responses,
+    same as the default one with the fast encoder
+    '''
+    settings = dict(current_app.config.get('RESTPLUS_JSON', {}))
+    if current_app.debug:
+        settings.setdefault('indent', 4)
+        settings.setdefault('sort_keys', True)
+    resp = make_response(dumps(data, **settings) + '\n', code)
+    resp.headers.extend(headers or {})
+    return resp
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+'''
+Related objects inlined in responses with the expand parameter.
+
+Relations between li3ds tables are registered by the api modules. The
+requested ones (dotted paths for nested relations, ie
+``expand=platform,datasources.referential.sensor``) are built as jsonb
+by a single query: the row is merged with a subquery per relation,
+aggregated with jsonb_agg for one to many relations.
+'''
+from collections import defaultdict, OrderedDict
+
+from flask import request, current_app
+from flask_restplus import fields, marshal
+
+from api_li3ds.app import api, requested_fields
+from api_li3ds.database import Database
+
+# maximum number of relations in a path
+MAX_DEPTH = 3
+
+_relations = defaultdict(OrderedDict)
+
+
+class Relation():
+    '''
+    Object (or list of objects if ``many``) of ``table`` related to a row.
+    ``condition`` joins them, {child} and {parent} being the table aliases.
+    ``model`` may be given by name to avoid circular imports
+    '''
+
+    def __init__(self, table, model, condition, many=False):
+        self.table = table
+        self.model = model
+        self.condition = condition
+        self.many = many
+
+    def resolved_model(self):
+        if isinstance(self.model, str):
+            return api.models[self.model]
+        return self.model
+
+
+def relation(table, name, *args, **kwargs):
+    '''
+    Registers the relation ``name`` of the rows of ``table``
+    '''
+    _relations[table][name] = Relation(*args, **kwargs)
+
+
+def relation_names(table):
+    return list(_relations[table])
+
+
+def requested_relations(table):
+    '''
+    Returns the tree of relations asked with the expand parameter
+    (an empty dict if not given)
+    '''
+    tree = OrderedDict()
+    for path in request.args.get('expand', '').split(','):
+        path = path.strip()
+        if not path:
+            continue
+        names = path.split('.')
+        if len(names) > MAX_DEPTH:
+            api.abort(400, 'expand paths have at most {} relations'.format(MAX_DEPTH))
+        node, current = tree, table
+        for name in names:
+            if name not in _relations[current]:
+                api.abort(400, 'Unknown relation: {}'.format(path), errors={
+                    'expand': '{} relations are {}'.format(
+                        current, ', '.join(_relations[current]) or 'none')})
+            node = node.setdefault(name, OrderedDict())
+            current = _relations[current][name].table
+    return tree
+
+
+def jsonb_sql(table, alias, tree, columns=None, depth=0):
+    '''
+    Returns the jsonb expression of a row of ``table`` named ``alias``
+    (restricted to ``columns`` if given) with its relations
+    '''
+    if columns is None:
+        row = 'to_jsonb({})'.format(alias)
+    else:
+        row = 'jsonb_build_object({})'.format(', '.join(
+            "'{0}', {1}.\"{0}\"".format(column, alias) for column in columns))
+    if not tree:
+        return row
+    items = []
+    for name, subtree in tree.items():
+        rel = _relations[table][name]
+        child = 't{}'.format(depth + 1)
+        expression = jsonb_sql(rel.table, child, subtree, depth=depth + 1)
+        condition = rel.condition.format(parent=alias, child=child)
+        if rel.many:
+            sql = "(select coalesce(jsonb_agg({} order by {}.id), '[]') from li3ds.{} {} where {})"
+            sql = sql.format(expression, child, rel.table, child, condition)
+        else:
+            sql = "(select {} from li3ds.{} {} where {})".format(
+                expression, rel.table, child, condition)
+        items.append("'{}', {}".format(name, sql))
+    return '{} || jsonb_build_object({})'.format(row, ', '.join(items))
+
+
+def expanded_fields(table, model, tree):
+    '''
+    Returns the fields of ``model`` with the related ones nested
+    '''
+    result = OrderedDict(model.resolved)
+    for name, subtree in tree.items():
+        rel = _relations[table][name]
+        nested = fields.Nested(
+            expanded_fields(rel.table, rel.resolved_model(), subtree), allow_null=True)
+        result[name] = fields.List(nested) if rel.many else nested
+    return result
+
+
+def expanded(table, model, where, parameters=None, not_found=None):
+    '''
+    Returns the response listing the rows of ``table`` (named t) matching
+    ``where`` with the relations asked with the expand parameter,
+    None if it is not given. Aborts with 404 and the ``not_found``
+    message if given and no row matches
+    '''
+    tree = requested_relations(table)
+    if not tree:
+        return None
+    fields_ = expanded_fields(table, model, tree)
+    names = requested_fields(fields_)
+    columns = None
+    mask = request.headers.get(current_app.config['RESTPLUS_MASK_HEADER'])
+    if names is not None:
+        columns = [name for name in names if name in model.resolved]
+        mask = ','.join(names)
+    rows = Database.query_aslist(
+        'select {} from li3ds.{} t where {} order by t.id'.format(
+            jsonb_sql(table, 't', tree, columns), table, where),
+        parameters)
+    if not rows and not_found:
+        api.abort(404, not_found)
+    return api.make_response(marshal(rows, fields_, mask=mask), 200)
+
+
+def expand_params(table):
+    '''
+    Documentation of the expand parameter of ``table`` resources
+    '''
+    return {
+        'expand': 'comma separated list of related objects to include, '
+                  'dotted for nested ones ({})'.format(', '.join(relation_names(table)))
+    }
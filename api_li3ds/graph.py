@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+'''
+In memory index of the transformation graphs of platform configurations.
+
+Nodes are referentials and edges are transformations, followed from
+their source to their target referential and only if their validity
+period overlaps the one asked for. All edges have the same cost so
+shortest paths are found with a breadth first search.
+'''
+from collections import deque, defaultdict
+from threading import Lock
+from time import monotonic
+
+from flask import current_app
+
+from api_li3ds.database import Database
+from api_li3ds.changes import changes
+
+
+class TransfoGraph():
+    '''
+    Transformation graph of a platform configuration
+    '''
+
+    def __init__(self, transfos, referentials=()):
+        '''
+        :param transfos: (id, source, target, validity_start, validity_end) rows,
+                         validity bounds being optional
+        :param referentials: (id, root, sensor_type) rows
+        '''
+        # transformations leading to each referential
+        self.incoming = defaultdict(list)
+        for tid, source, target, *validity in sorted(transfos):
+            start, end = (tuple(validity) + (None, None))[:2]
+            self.incoming[target].append((tid, source, start, end))
+        self.referentials = {ref[0]: ref for ref in referentials}
+
+    def roots(self, sensor_type=None):
+        '''
+        Root referentials, optionally of a given sensor type
+        '''
+        return sorted(
+            rid for rid, root, stype in self.referentials.values()
+            if root and (sensor_type is None or stype == sensor_type)
+        )
+
+    @staticmethod
+    def _valid(validity_start, validity_end, start, end):
+        '''
+        True if a transformation validity overlaps the [start, end] period,
+        missing bounds being unlimited
+        '''
+        if validity_start is not None and end is not None and validity_start > end:
+            return False
+        if validity_end is not None and start is not None and validity_end < start:
+            return False
+        return True
+
+    def _tree(self, target, start=None, end=None):
+        '''
+        Breadth first search from target following transformations backwards,
+        returns {referential: (transfo, next referential towards target)}
+        '''
+        parents = {target: None}
+        queue = deque([target])
+        while queue:
+            node = queue.popleft()
+            for tid, other, validity_start, validity_end in self.incoming.get(node, ()):
+                if other in parents:
+                    continue
+                if not self._valid(validity_start, validity_end, start, end):
+                    continue
+                parents[other] = (tid, node)
+                queue.append(other)
+        return parents
+
+    @staticmethod
+    def _walk(parents, source):
+        if source not in parents:
+            return None
+        path = []
+        while parents[source] is not None:
+            tid, source = parents[source]
+            path.append(tid)
+        return path
+
+    def path(self, source, target, start=None, end=None):
+        '''
+        Returns the transformations identifiers from source to target referentials
+        valid during [start, end], or None if they are not connected
+        '''
+        return self._walk(self._tree(target, start, end), source)
+
+    def paths(self, sources, target, start=None, end=None):
+        '''
+        Shortest paths from several sources to the same target
+        computed with a single search, returns {source: path}
+        '''
+        parents = self._tree(target, start, end)
+        return {source: self._walk(parents, source) for source in sources}
+
+
+class GraphIndex():
+    '''
+    Transformation graphs by platform configuration, loaded on demand.
+    Graphs are dropped when transformations or trees are modified
+    by this process or notified by postgres, and after ``graph_ttl``
+    seconds otherwise.
+    '''
+
+    def __init__(self):
+        self._graphs = {}
+        self._lock = Lock()
+
+    def get(self, config):
+        ttl = current_app.config.get('graph_ttl', 60)
+        with self._lock:
+            graph, loaded = self._graphs.get(config, (None, None))
+        if graph is not None and monotonic() - loaded < ttl:
+            return graph
+        graph = self.load(config)
+        with self._lock:
+            self._graphs[config] = (graph, monotonic())
+        return graph
+
+    @staticmethod
+    def load(config):
+        transfos = Database.query("""
+            select distinct t.id, t.source, t.target, t.validity_start, t.validity_end
+            from li3ds.platform_config pf
+            join li3ds.transfo_tree tt on tt.id = ANY(pf.transfo_trees)
+            join li3ds.transfo t on t.id = ANY(tt.transfos)
+            where pf.id = %s
+            """, (config, ))
+        refs = set()
+        for transfo in transfos:
+            refs.update((transfo.source, transfo.target))
+        referentials = Database.query("""
+            select r.id, r.root, s.type::text
+            from li3ds.referential r
+            left join li3ds.sensor s on s.id = r.sensor
+            where r.id = ANY(%s)
+            """, (sorted(refs), ))
+        return TransfoGraph(
+            [tuple(transfo) for transfo in transfos],
+            [tuple(ref) for ref in referentials])
+
+    def invalidate(self, config=None):
+        '''
+        Drops the graph of a platform config, or all of them
+        '''
+        with self._lock:
+            if config is None:
+                self._graphs.clear()
+            else:
+                self._graphs.pop(config, None)
+
+
+graphs = GraphIndex()
+changes.subscribe(
+    graphs.invalidate, 'transfo', 'transfo_tree', 'platform_config', 'referential', 'sensor')
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+'''
+In memory memoization of computed responses.
+
+Values are dropped explicitly by the write endpoints of this process
+and expire after a time to live otherwise, so that writes made by other
+workers are eventually seen.
+'''
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+from flask import current_app
+
+
+class Memo():
+    '''
+    Values keyed on a tuple, kept for the ``ttl_setting`` seconds
+    at most, the least recently used ones being dropped when there are
+    more than ``maxsize`` of them
+    '''
+
+    def __init__(self, ttl_setting, default_ttl=60, maxsize=1024):
+        self.ttl_setting = ttl_setting
+        self.default_ttl = default_ttl
+        self.maxsize = maxsize
+        self._values = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, compute):
+        '''
+        Returns the value for key, calling compute() if it is missing or expired
+        '''
+        value = self.lookup(key)
+        if value is None:
+            value = compute()
+            self.store(key, value)
+        return value
+
+    def lookup(self, key):
+        '''
+        Returns the value for key or None if it is missing or expired
+        '''
+        ttl = current_app.config.get(self.ttl_setting, self.default_ttl)
+        with self._lock:
+            value, stored = self._values.get(key, (None, None))
+            if stored is not None and monotonic() - stored < ttl:
+                self._values.move_to_end(key)
+                return value
+        return None
+
+    def store(self, key, value):
+        with self._lock:
+            self._values[key] = (value, monotonic())
+            self._values.move_to_end(key)
+            while len(self._values) > self.maxsize:
+                self._values.popitem(last=False)
+
+    def invalidate(self, key=None):
+        '''
+        Drops the value of a key, or all of them
+        '''
+        with self._lock:
+            if key is None:
+                self._values.clear()
+            else:
+                self._values.pop(key, None)
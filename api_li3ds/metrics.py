@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+'''
+In-process metrics served in the prometheus text format on /metrics.
+
+Metrics are kept per process: with several uwsgi workers
+each scrape reports the worker that answered.
+
+Queries are labelled by a fingerprint of their text where the select
+lists built for the fields and expand parameters are elided, and the
+number of fingerprints is bounded by the metrics_max_queries setting,
+the queries beyond it being counted under the "other" label.
+'''
+import re
+from bisect import bisect_left
+from hashlib import sha1
+from threading import Lock
+from time import monotonic
+from functools import lru_cache
+
+from flask import request, g, has_request_context, Response
+
+# upper bounds (seconds) of latency histograms buckets
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+# name: (type, help)
+METRICS = {
+    'li3ds_request_duration_seconds': (
+        'histogram', 'Time spent answering requests'),
+    'li3ds_response_bytes_total': (
+        'counter', 'Bytes serialized in responses'),
+    'li3ds_query_duration_seconds': (
+        'histogram', 'Time spent running queries'),
+    'li3ds_query_rows_total': (
+        'counter', 'Rows returned or affected by queries'),
+    'li3ds_pool_wait_seconds': (
+        'histogram', 'Time spent waiting for a database connection'),
+}
+
+# distinct query fingerprints labelled, per process
+MAX_QUERIES = 500
+OTHER = 'other'
+
+WHITESPACES = re.compile(r'\s+')
+BUILD_OBJECT = re.compile(r'\bjsonb?_build_object\(')
+# columns of a select list built for the fields or expand parameters
+SELECTED = r'(?:\w+\.)?(?:\*|"\w+")|to_jsonb\(\w+\)|jsonb?_build_object\(\?\)'
+SELECT_LIST = re.compile(r'\bselect (?:{0})(?:(?:, | \|\| )(?:{0}))* from\b'.format(SELECTED))
+
+
+@lru_cache(maxsize=1024)
+def normalize(query):
+    return WHITESPACES.sub(' ', query).strip()
+
+
+def elide_objects(query):
+    '''
+    Replaces the arguments of json(b)_build_object calls with ?
+    '''
+    parts, pos = [], 0
+    for match in BUILD_OBJECT.finditer(query):
+        if match.start() < pos:
+            # nested in a call already elided
+            continue
+        parts.append(query[pos:match.end()])
+        depth, pos = 1, match.end()
+        while depth and pos < len(query):
+            depth += {'(': 1, ')': -1}.get(query[pos], 0)
+            pos += 1
+        parts.append('?)')
+    parts.append(query[pos:])
+    return ''.join(parts)
+
+
+@lru_cache(maxsize=1024)
+def template(query):
+    '''
+    Normalized query text where the select lists and json objects
+    depending on the fields and expand parameters are replaced by *
+    '''
+    return SELECT_LIST.sub('select * from', elide_objects(normalize(query)))
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(query):
+    '''
+    Short identifier of a query template (before parameters interpolation)
+    '''
+    return sha1(template(query).encode('utf-8')).hexdigest()[:12]
+
+
+def namespace():
+    '''
+    Namespace of the current request (first segment of the url rule)
+    '''
+    if not has_request_context() or request.url_rule is None:
+        return 'none'
+    return request.url_rule.rule.strip('/').split('/')[0] or 'root'
+
+
+def endpoint():
+    if not has_request_context():
+        return 'none'
+    return request.endpoint or 'none'
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels, extra=None):
+    labels = list(labels) + ([extra] if extra else [])
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, escape(v)) for k, v in labels) + '}'
+
+
+class Histogram():
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        cumulative = 0
+        for bound, value in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += value
+            yield '{}_bucket{} {}'.format(name, format_labels(labels, ('le', bound)), cumulative)
+        yield '{}_sum{} {}'.format(name, format_labels(labels), self.sum)
+        yield '{}_count{} {}'.format(name, format_labels(labels), self.count)
+
+
+class Metrics():
+    '''
+    Registry of counters and histograms indexed by name and labels
+    '''
+
+    def __init__(self):
+        self._lock = Lock()
+        self._values = {}
+        self._queries = {}
+        self._collectors = []
+        self.max_queries = MAX_QUERIES
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = Histogram()
+            self._values[key].observe(value)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def observe_query(self, query, seconds, rows=None):
+        '''
+        Records a query execution for the current endpoint
+        '''
+        fp = fingerprint(query)
+        if fp not in self._queries:
+            with self._lock:
+                if len(self._queries) < self.max_queries:
+                    self._queries.setdefault(fp, template(query))
+                elif fp not in self._queries:
+                    fp = OTHER
+        labels = {'namespace': namespace(), 'endpoint': endpoint(), 'query': fp}
+        self.observe('li3ds_query_duration_seconds', seconds, **labels)
+        if rows is not None and rows > 0:
+            self.inc('li3ds_query_rows_total', rows, **labels)
+
+    def queries(self):
+        '''
+        Returns query texts by fingerprint
+        '''
+        with self._lock:
+            return dict(self._queries)
+
+    def collector(self, func):
+        '''
+        Registers a function returning (name, type, help, value) tuples
+        computed when metrics are rendered, once even if several
+        applications register it
+        '''
+        with self._lock:
+            if func not in self._collectors:
+                self._collectors.append(func)
+        return func
+
+    def count_stream(self, chunks, **labels):
+        '''
+        Yields the chunks of a streamed response, their size being
+        added to the bytes served when the stream ends
+        '''
+        size = 0
+        try:
+            for chunk in chunks:
+                size += len(chunk)
+                yield chunk
+        finally:
+            if size:
+                self.inc('li3ds_response_bytes_total', size, **labels)
+
+    def render(self):
+        '''
+        Returns all metrics in the prometheus text format
+        '''
+        with self._lock:
+            values = sorted(
+                (key, value if isinstance(value, (int, float)) else list(value.render(*key)))
+                for key, value in self._values.items()
+            )
+        lines = []
+        current = None
+        for (name, labels), value in values:
+            if name != current:
+                current = name
+                kind, doc = METRICS.get(name, ('untyped', name))
+                lines.append('# HELP {} {}'.format(name, doc))
+                lines.append('# TYPE {} {}'.format(name, kind))
+            if isinstance(value, list):
+                lines.extend(value)
+            else:
+                lines.append('{}{} {}'.format(name, format_labels(labels), value))
+        for func in self._collectors:
+            for name, kind, doc, value in func():
+                lines.append('# HELP {} {}'.format(name, doc))
+                lines.append('# TYPE {} {}'.format(name, kind))
+                lines.append('{} {}'.format(name, value))
+        return '\n'.join(lines) + '\n'
+
+    def init_app(self, app):
+        '''
+        Time requests and serve metrics on /metrics
+        '''
+        self.max_queries = app.config.get('metrics_max_queries', MAX_QUERIES)
+
+        @app.before_request
+        def start_timer():
+            g.li3ds_start = monotonic()
+
+        @app.after_request
+        def stop_timer(response):
+            if 'li3ds_start' in g:
+                labels = {
+                    'namespace': namespace(),
+                    'endpoint': endpoint(),
+                    'method': request.method,
+                    'status': response.status_code,
+                }
+                self.observe('li3ds_request_duration_seconds', monotonic() - g.li3ds_start, **labels)
+                sizelabels = {'namespace': labels['namespace'], 'endpoint': labels['endpoint']}
+                if response.is_streamed and not response.direct_passthrough:
+                    # the length is only known once the stream is sent
+                    response.response = self.count_stream(response.iter_encoded(), **sizelabels)
+                elif response.content_length:
+                    self.inc('li3ds_response_bytes_total', response.content_length, **sizelabels)
+            return response
+
+        app.add_url_rule('/metrics', 'metrics', self.view)
+
+    def view(self):
+        return Response(self.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+metrics = Metrics()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+'''
+Build json documents in postgres with the same content as restplus
+marshalling so that they can be sent without being decoded in python.
+'''
+from flask_restplus import fields
+
+# same output as DateTime.format_iso8601, ie python's isoformat():
+# microseconds only when not null and utc offset as +HH:MM
+DATETIME_SQL = (
+    "to_char({col}, 'YYYY-MM-DD\"T\"HH24:MI:SS')"
+    " || case when to_char({col}, 'US') = '000000' then '' else to_char({col}, '.US') end"
+    " || case when pg_typeof({col}) = 'timestamptz'::regtype"
+    " then regexp_replace(to_char({col}, 'OF'), '^([+-][0-9]{{2}})$', '\\1:00')"
+    " else '' end"
+)
+
+# postgres expressions giving the same json value as the restplus field.
+# Only exact field classes are listed: subclasses may format differently.
+FIELD_SQL = {
+    fields.Raw: '{col}',
+    fields.Boolean: '{col}',
+    fields.Integer: '{col}',
+    fields.Float: '{col}::float8',
+    fields.String: '{col}::text',
+}
+
+_cache = {}
+
+
+class UnsupportedModel(ValueError):
+    '''
+    Raised when a model cannot be reproduced in SQL
+    '''
+
+
+def field_sql(name, field):
+    '''
+    Returns the SQL expression giving the json value of ``field``
+    '''
+    if isinstance(field, type):
+        field = field()
+    col = 't."{}"'.format((field.attribute or name).replace('"', '""'))
+
+    if field.default is not None:
+        raise UnsupportedModel('field {} has a default value'.format(name))
+    if type(field) in FIELD_SQL:
+        return FIELD_SQL[type(field)].format(col=col)
+    if type(field) is fields.DateTime and field.dt_format == 'iso8601':
+        return DATETIME_SQL.format(col=col)
+    if type(field) is fields.List and type(field.container) in (
+            fields.Raw, fields.Integer, fields.String, fields.Boolean):
+        return col
+    raise UnsupportedModel('field {} of type {} is not supported'.format(
+        name, type(field).__name__))
+
+
+def json_object(model, names=None):
+    '''
+    Returns a json_build_object expression building one object
+    of ``model`` (restricted to the ``names`` fields if given)
+    from a row named ``t``.
+    Raises UnsupportedModel if the model can not be reproduced in SQL.
+    '''
+    key = (model.name, tuple(names) if names else None)
+    if key not in _cache:
+        try:
+            args = ', '.join(
+                "'{}', {}".format(name, field_sql(name, field))
+                for name, field in model.resolved.items()
+                if not names or name in names
+            )
+            _cache[key] = 'json_build_object({})'.format(args)
+        except UnsupportedModel as exc:
+            _cache[key] = exc
+    if isinstance(_cache[key], UnsupportedModel):
+        raise _cache[key]
+    return _cache[key]
+
+
+def supported(model, names=None):
+    '''
+    Returns True if json documents for ``model`` can be built in postgres
+    '''
+    try:
+        json_object(model, names)
+    except UnsupportedModel:
+        return False
+    return True
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+'''
+Precomputed image poses.
+
+Poses of a session only depend on its images and on the latest
+posdatasource of the project. They are stored in the ``image_pose`` table
+of the project schema, and ``image_pose_state`` keeps for each session the
+posdatasource and a signature of the image rows they were computed from,
+so that only sessions whose images or route changed are recomputed.
+
+The tables are created and filled by refresh (the images/refresh
+endpoint), reads use them only for the sessions that are up to date.
+'''
+from threading import Lock
+
+from psycopg2.extensions import AsIs
+
+from api_li3ds.database import Database
+
+# poses of the images of a session interpolated along the latest route,
+# only for the images taken in [start, end] (epochs, null for no bound)
+POSES_QUERY = """
+    with images as (
+        -- extract image epoch
+        select
+            i.id,
+            i.filename,
+            i.etime,
+            extract(epoch from etime) as epoch,
+            rf.sensor
+        from %(project)s.image i
+        join li3ds.datasource ds on i.datasource = ds.id
+        join li3ds.referential rf on ds.referential = rf.id
+        where ds.session = %(session)s
+        and (%(start)s::float8 is null or i.etime >= to_timestamp(%(start)s::float8))
+        and (%(end)s::float8 is null or i.etime <= to_timestamp(%(end)s::float8))
+    ), posdatasource as (
+        -- get latest version of the route
+        select max(pds.id) as id, max(version)
+        from li3ds.project p
+        join li3ds.session s on s.project = p.id
+        join li3ds.posdatasource pds on pds.session = s.id
+        where p.id = %(project_id)s
+    )
+    select
+        i.id,
+        i.filename,
+        i.etime as date,
+        i.sensor,
+        pc_get(newpt, 'x') as easting,
+        pc_get(newpt, 'y') as northing,
+        pc_get(newpt, 'z') as altitude,
+        pc_get(newpt, 'm_roll') as roll,
+        pc_get(newpt, 'm_pitch') as pitch,
+        pc_get(newpt, 'm_plateformHeading')
+            - pc_get(newpt, 'm_wanderAngle') as heading
+    from posdatasource pds
+    join %(project)s.route r on pds.id = r.posdatasource
+    join images i on i.etime <@ tstzrange(r.start_time, r.end_time),
+    pc_interpolate(r.points, 'm_time', i.epoch) as newpt
+    """
+
+_created = set()
+_lock = Lock()
+
+
+def create(project):
+    '''
+    Creates the pose tables of a project schema if needed,
+    only called by refresh so that reads never run ddl
+    '''
+    with _lock:
+        if project in _created:
+            return
+    Database.rowcount("""
+        create table if not exists %(project)s.image_pose (
+            id integer primary key,
+            session integer not null,
+            filename varchar,
+            date timestamptz,
+            sensor integer,
+            easting numeric,
+            northing numeric,
+            altitude numeric,
+            roll numeric,
+            pitch numeric,
+            heading numeric
+        );
+        create index if not exists image_pose_session_date_idx
+            on %(project)s.image_pose (session, date);
+        create index if not exists image_pose_point_idx
+            on %(project)s.image_pose
+            using gist (st_makepoint(easting::float8, northing::float8));
+        create table if not exists %(project)s.image_pose_state (
+            session integer primary key,
+            posdatasource integer,
+            images text not null,
+            refreshed timestamptz not null default now()
+        )
+        """, {'project': AsIs(project)})
+    with _lock:
+        _created.add(project)
+
+
+def exists(project):
+    '''
+    True if the pose tables of a project have been created
+    '''
+    with _lock:
+        if project in _created:
+            return True
+    if not Database.query(
+            "select to_regclass(%(table)s) is not null as found",
+            {'table': '{}.image_pose_state'.format(project)})[0].found:
+        return False
+    with _lock:
+        _created.add(project)
+    return True
+
+
+def stale(project, project_id, session=None, force=False):
+    '''
+    Returns (session, posdatasource, images signature) rows
+    of the sessions whose stored poses are missing or out of date.
+    The signature sums the hashes of the image rows of a session with
+    their datasource and referential: it changes when one of them is
+    added, edited or deleted and needs neither sorting nor concatenation
+    '''
+    return Database.query("""
+        with posdatasource as (
+            select max(pds.id) as id
+            from li3ds.session s
+            join li3ds.posdatasource pds on pds.session = s.id
+            where s.project = %(project_id)s
+        ), latest as (
+            select
+                s.id as session,
+                (select id from posdatasource) as posdatasource,
+                (
+                    select count(*) || ':' || coalesce(sum(hashtext(concat_ws(
+                        ':', i.id, i.filename, i.etime, ds.id, rf.id, rf.sensor))::bigint), 0)
+                    from %(project)s.image i
+                    join li3ds.datasource ds on i.datasource = ds.id
+                    join li3ds.referential rf on ds.referential = rf.id
+                    where ds.session = s.id
+                ) as images
+            from li3ds.session s
+            where s.project = %(project_id)s
+            and (%(session)s::integer is null or s.id = %(session)s)
+        )
+        select c.session, c.posdatasource, c.images
+        from latest c
+        left join %(project)s.image_pose_state st on st.session = c.session
+        where %(force)s
+        or st.session is null
+        or st.posdatasource is distinct from c.posdatasource
+        or st.images != c.images
+        order by c.session
+        """, {'project': AsIs(project), 'project_id': project_id,
+              'session': session, 'force': force})
+
+
+def refresh_session(project, project_id, state):
+    '''
+    Recomputes the poses of a session in a single transaction,
+    ``state`` being a row returned by stale
+    '''
+    parameters = {
+        'project': AsIs(project),
+        'project_id': project_id,
+        'session': state.session,
+        'posdatasource': state.posdatasource,
+        'images': state.images,
+        'start': None,
+        'end': None,
+    }
+    with Database.transaction():
+        # concurrent refreshes of the same session wait for each other
+        Database.query(
+            "select pg_advisory_xact_lock(hashtext('image_pose'), %(session)s)", parameters)
+        Database.rowcount(
+            "delete from %(project)s.image_pose where session = %(session)s", parameters)
+        Database.rowcount("""
+            insert into %(project)s.image_pose
+                (id, filename, date, sensor, easting, northing, altitude,
+                 roll, pitch, heading, session)
+            select poses.*, %(session)s::integer from ({}) as poses
+            """.format(POSES_QUERY), parameters)
+        Database.rowcount(
+            "delete from %(project)s.image_pose_state where session = %(session)s", parameters)
+        Database.rowcount("""
+            insert into %(project)s.image_pose_state (session, posdatasource, images)
+            values (%(session)s, %(posdatasource)s, %(images)s)
+            """, parameters)
+
+
+def refresh(project, project_id, session=None, force=False):
+    '''
+    Recomputes the out of date sessions of a project (or only one session)
+    and returns their identifiers
+    '''
+    create(project)
+    sessions = []
+    for state in stale(project, project_id, session, force):
+        refresh_session(project, project_id, state)
+        sessions.append(state.session)
+    return sessions
+
+
+# stored poses of a session (not ordered so that it can be
+# inlined in queries using the table indexes)
+STORE_QUERY = """
+    select id, filename, date, sensor, easting, northing, altitude, roll, pitch, heading
+    from %(project)s.image_pose
+    where session = %(session)s
+    """
+
+
+def prepare(project, project_id, session):
+    '''
+    Returns the parameters of STORE_QUERY if the stored poses of a
+    session are up to date, None if they are missing or stale
+    (they are only computed by refresh)
+    '''
+    if not exists(project) or stale(project, project_id, session):
+        return None
+    return {'project': AsIs(project), 'session': session}
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+'''
+Log of queries slower than the slow_query_threshold setting,
+with their execution plan, in a file (one json object per line).
+
+The file is shared by the uwsgi workers: it is opened in append mode and
+reopened when it is moved, so that it can be rotated by logrotate.
+'''
+import json
+import logging
+from datetime import datetime
+from logging.handlers import WatchedFileHandler
+from threading import Lock
+from time import monotonic
+
+from psycopg2 import Error as PsycoError
+from psycopg2.extensions import AsIs
+
+from api_li3ds.metrics import fingerprint, normalize, endpoint
+
+EXPLAINABLE = ('select', 'with', 'insert', 'update', 'delete', 'values')
+
+
+def redact(parameters):
+    '''
+    Replace parameter values by their type name,
+    identifiers given as AsIs are kept since they are part of the query
+    '''
+    def hide(value):
+        if isinstance(value, AsIs):
+            return value.getquoted().decode()
+        return '<{}>'.format(type(value).__name__)
+
+    if parameters is None:
+        return None
+    if isinstance(parameters, dict):
+        return {key: hide(value) for key, value in parameters.items()}
+    return [hide(value) for value in parameters]
+
+
+class SlowQueryLog():
+    '''
+    Records slow queries. A plan is captured at most once
+    per query and per ``explain_interval`` seconds.
+    '''
+
+    def __init__(self):
+        self.threshold = None
+        self.explain_interval = 300
+        self.logger = logging.getLogger('api_li3ds.slowqueries')
+        self.logger.propagate = False
+        self._explained = {}
+        self._lock = Lock()
+        self._handler = None
+
+    def init_app(self, app):
+        self.threshold = app.config.get('slow_query_threshold')
+        if not self.threshold:
+            return
+        self.explain_interval = app.config.get('slow_query_explain_interval', 300)
+        handler = WatchedFileHandler(app.config.get('slow_query_log', 'slow_queries.log'))
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        if self._handler is not None:
+            self.logger.removeHandler(self._handler)
+            self._handler.close()
+        self._handler = handler
+        self.logger.addHandler(handler)
+        self.logger.setLevel(logging.INFO)
+
+    def is_slow(self, seconds):
+        return bool(self.threshold) and seconds >= self.threshold
+
+    def _should_explain(self, fp):
+        now = monotonic()
+        with self._lock:
+            last = self._explained.get(fp)
+            if last is not None and now - last < self.explain_interval:
+                return False
+            self._explained[fp] = now
+        return True
+
+    def explain(self, conn, query, parameters):
+        '''
+        Returns the plan of the query (without running it). Inside a
+        transaction it is run under a savepoint so that an error does not
+        abort the transaction of the caller
+        '''
+        if not normalize(query).lower().startswith(EXPLAINABLE):
+            return None
+        savepoint = not conn.autocommit
+        try:
+            with conn.cursor() as cur:
+                if savepoint:
+                    cur.execute('savepoint li3ds_explain')
+                try:
+                    cur.execute('explain (analyze off, format json) ' + query, parameters)
+                    plan = cur.fetchone()[0]
+                except PsycoError as exc:
+                    plan = {'error': exc.pgerror or str(exc)}
+                    if savepoint:
+                        cur.execute('rollback to savepoint li3ds_explain')
+                if savepoint:
+                    cur.execute('release savepoint li3ds_explain')
+        except PsycoError as exc:
+            plan = {'error': exc.pgerror or str(exc)}
+        return plan
+
+    def record(self, conn, query, parameters, seconds):
+        '''
+        Writes a slow query entry, with its plan if not captured recently
+        '''
+        fp = fingerprint(query)
+        plan = None
+        if self._should_explain(fp):
+            plan = self.explain(conn, query, parameters)
+        self.logger.info(json.dumps({
+            'time': datetime.utcnow().isoformat(),
+            'duration': seconds,
+            'endpoint': endpoint(),
+            'fingerprint': fp,
+            'query': normalize(query),
+            'parameters': redact(parameters),
+            'plan': plan,
+        }))
+
+
+slowlog = SlowQueryLog()
@@ -0,0 +1,53 @@
+-- Notifications of the changes made to the li3ds schema tables.
+--
+-- Each statement modifying a table appends a row to li3ds.table_change
+-- with a new generation taken from a sequence, and sends it on the
+-- li3ds_<table> channel. The api listens to these channels to invalidate
+-- its caches, and reads the greatest generation of each table when it
+-- connects. Concurrent writers only insert rows, they never wait for each
+-- other; the rows older than the greatest one of their table are deleted
+-- by the api.
+--
+-- Run it again when tables are added to the schema:
+--   psql -d li3ds -f api_li3ds/sql/notify.sql
+
+create sequence if not exists li3ds.table_change_generation;
+
+create table if not exists li3ds.table_change (
+    generation bigint primary key default nextval('li3ds.table_change_generation'),
+    table_name varchar not null,
+    modified timestamptz not null default now()
+);
+
+create index if not exists table_change_table_name_idx
+    on li3ds.table_change (table_name, generation);
+
+create or replace function li3ds.notify_change() returns trigger as $$
+declare
+    gen bigint;
+begin
+    insert into li3ds.table_change (table_name) values (TG_TABLE_NAME)
+    returning generation into gen;
+    perform pg_notify('li3ds_' || TG_TABLE_NAME, gen::text);
+    return null;
+end;
+$$ language plpgsql;
+
+do $$
+declare
+    tbl text;
+begin
+    for tbl in
+        select table_name from information_schema.tables
+        where table_schema = 'li3ds'
+        and table_type = 'BASE TABLE'
+        and table_name != 'table_change'
+    loop
+        execute format('drop trigger if exists li3ds_notify on li3ds.%I', tbl);
+        execute format(
+            'create trigger li3ds_notify '
+            'after insert or update or delete or truncate on li3ds.%I '
+            'for each statement execute procedure li3ds.notify_change()', tbl);
+    end loop;
+end;
+$$;
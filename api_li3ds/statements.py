@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+'''
+Server side prepared statements.
+
+Each connection keeps a LRU registry of the statements prepared on it,
+keyed by query text. Queries are converted from psycopg2 placeholders
+to PREPARE/EXECUTE statements so postgres parses and plans them once.
+'''
+import re
+from itertools import count
+from threading import Lock
+from collections import OrderedDict, Counter
+
+from psycopg2 import Error as PsycoError
+from psycopg2.extensions import connection, AsIs
+
+# psycopg2 placeholders: %s, %(name)s and escaped %%
+PLACEHOLDERS = re.compile(r"%(?:\((\w+)\))?s|%%")
+
+# raised by EXECUTE when a table used by the statement changed
+FEATURE_NOT_SUPPORTED = '0A000'
+
+statement_names = count()
+
+stats = Counter()
+stats_lock = Lock()
+
+
+def incr(key):
+    with stats_lock:
+        stats[key] += 1
+
+
+class Li3dsConnection(connection):
+    '''
+    Connection holding its prepared statements registry
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # query text -> statement name (None if the query can't be prepared)
+        self.statements = OrderedDict()
+
+
+def convert(query, parameters):
+    '''
+    Converts a psycopg2 query to a query with $n parameters.
+    Returns the converted query and the list of arguments.
+    AsIs parameters (identifiers...) are inlined in the query.
+    '''
+    if parameters is None:
+        # no interpolation is done by psycopg2 in this case
+        return query, []
+
+    args = []
+    positions = {}
+    positional = None if isinstance(parameters, dict) else iter(parameters)
+
+    def replace(match):
+        if match.group(0) == '%%':
+            return '%'
+        name = match.group(1)
+        value = next(positional) if name is None else parameters[name]
+        if isinstance(value, AsIs):
+            return value.getquoted().decode()
+        if name in positions:
+            return positions[name]
+        args.append(value)
+        placeholder = '${}'.format(len(args))
+        if name is not None:
+            positions[name] = placeholder
+        return placeholder
+
+    return PLACEHOLDERS.sub(replace, query), args
+
+
+def _prepare(cur, statement, size):
+    statements = cur.connection.statements
+    name = 'li3ds_{}'.format(next(statement_names))
+    # a failed prepare must not abort the current transaction
+    savepoint = not cur.connection.autocommit
+    if savepoint:
+        cur.execute('savepoint li3ds_prepare')
+    try:
+        cur.execute('prepare {} as {}'.format(name, statement))
+        incr('prepares')
+    except PsycoError:
+        # parameter types can't always be inferred, run it unprepared
+        incr('failures')
+        name = None
+        if savepoint:
+            cur.execute('rollback to savepoint li3ds_prepare')
+    if savepoint:
+        cur.execute('release savepoint li3ds_prepare')
+    statements[statement] = name
+    while len(statements) > size:
+        _, evicted = statements.popitem(last=False)
+        incr('evictions')
+        if evicted is not None:
+            cur.execute('deallocate {}'.format(evicted))
+    return name
+
+
+def _savepoint(cur, command):
+    '''
+    Runs a savepoint command with another cursor so that
+    the results of ``cur`` are kept
+    '''
+    with cur.connection.cursor() as other:
+        other.execute('{} li3ds_execute'.format(command))
+
+
+def _run(cur, name, args):
+    cur.execute(
+        'execute {}{}'.format(
+            name, ' ({})'.format(', '.join(['%s'] * len(args))) if args else ''),
+        args)
+
+
+def execute(cur, query, parameters=None, size=100):
+    '''
+    Executes a query with ``cur`` through a prepared statement
+    '''
+    statement, args = convert(query, parameters)
+    statements = cur.connection.statements
+
+    if statement in statements:
+        incr('hits')
+        statements.move_to_end(statement)
+        name = statements[statement]
+    else:
+        incr('misses')
+        name = _prepare(cur, statement, size)
+
+    if name is None:
+        cur.execute(query, parameters)
+        return
+
+    # a failed execute must not abort the current transaction before
+    # the statement is prepared again
+    savepoint = not cur.connection.autocommit
+    if savepoint:
+        _savepoint(cur, 'savepoint')
+    try:
+        _run(cur, name, args)
+    except PsycoError as exc:
+        if exc.pgcode != FEATURE_NOT_SUPPORTED:
+            raise
+        # cached plan must not change result type: prepare it again
+        incr('invalidations')
+        if savepoint:
+            _savepoint(cur, 'rollback to savepoint')
+            _savepoint(cur, 'release savepoint')
+        del statements[statement]
+        cur.execute('deallocate {}'.format(name))
+        name = _prepare(cur, statement, size)
+        if name is None:
+            cur.execute(query, parameters)
+            return
+        _run(cur, name, args)
+    else:
+        if savepoint:
+            _savepoint(cur, 'release savepoint')
+
+
+def statement_stats():
+    with stats_lock:
+        return dict(stats)
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+'''
+Vectorized interpolation of platform poses along the route.
+
+Route patches (``<project>.route``) are read once and decoded in numpy
+arrays, then all the requested epochs of a patch are interpolated in a
+single pass, like ``pc_interpolate(points, 'm_time', epoch)`` does for
+one epoch.
+'''
+import numpy as np
+from psycopg2.extensions import AsIs
+
+from api_li3ds.database import Database
+
+# binary pose format: magic, version and count header (16 bytes)
+# followed by one little endian array per column
+BINARY_MAGIC = b'LI3DPOSE'
+BINARY_VERSION = 1
+BINARY_COLUMNS = (
+    ('id', '<i8'),
+    ('time', '<f8'),
+    ('easting', '<f8'),
+    ('northing', '<f8'),
+    ('altitude', '<f8'),
+    ('roll', '<f4'),
+    ('pitch', '<f4'),
+    ('heading', '<f4'),
+)
+
+# route dimensions read from the patches
+DIMENSIONS = ('x', 'y', 'z', 'm_roll', 'm_pitch', 'm_plateformHeading', 'm_wanderAngle')
+
+
+# angular dimensions, interpolated along the shortest arc
+ANGLES = ('m_roll', 'm_pitch', 'm_plateformHeading', 'm_wanderAngle')
+
+
+def unwrap(values, period):
+    '''
+    Removes the jumps of more than half a period between consecutive angles
+    '''
+    steps = np.diff(values)
+    steps -= period * np.round(steps / period)
+    return np.concatenate((values[:1], values[:1] + np.cumsum(steps)))
+
+
+def interpolate(epochs, times, values, period=None):
+    '''
+    Linear interpolation of ``values`` sampled at ``times`` for all ``epochs``.
+    ``times`` must be sorted. Epochs outside the sampled range give NaN
+    (``pc_interpolate`` in strict mode returns null).
+
+    Angles (``period`` given) are interpolated along the shortest arc and the
+    result is expressed in the turn of the sample preceding the epoch, so that
+    it is the same as a plain interpolation when the angle does not wrap.
+    '''
+    if period is None:
+        result = np.interp(epochs, times, values)
+    else:
+        unwrapped = unwrap(values, period)
+        result = np.interp(epochs, times, unwrapped)
+        previous = np.clip(np.searchsorted(times, epochs, side='right') - 1, 0, len(times) - 1)
+        result -= unwrapped[previous] - values[previous]
+    result[(epochs < times[0]) | (epochs > times[-1])] = np.nan
+    return result
+
+
+def interpolate_patch(epochs, patch, period=360.):
+    '''
+    Interpolates all dimensions of a decoded patch (dict of arrays
+    with a m_time entry) at the given epochs, returns a dict of arrays
+    '''
+    order = np.argsort(patch['m_time'], kind='mergesort')
+    times = patch['m_time'][order]
+    return {
+        dim: interpolate(epochs, times, patch[dim][order], period if dim in ANGLES else None)
+        for dim in DIMENSIONS
+    }
+
+
+def poses(images, patches, period=360.):
+    '''
+    Computes image poses.
+
+    :param images: rows with an ``epoch`` attribute
+    :param patches: decoded patches with ``start``/``end`` epochs
+    :param period: period of the angles (360 for degrees)
+    :returns: iterator of (image, pose) tuples, pose being a dict
+              with easting, northing, altitude, roll, pitch and heading
+    '''
+    if not images:
+        return
+    epochs = np.array([float(image.epoch) for image in images], dtype=np.float64)
+    for patch in patches:
+        # same as etime <@ tstzrange(start_time, end_time)
+        selected = np.nonzero((epochs >= patch['start']) & (epochs < patch['end']))[0]
+        if not len(selected) or not len(patch['m_time']):
+            continue
+        values = interpolate_patch(epochs[selected], patch, period)
+        heading = values['m_plateformHeading'] - values['m_wanderAngle']
+        columns = (
+            values['x'], values['y'], values['z'],
+            values['m_roll'], values['m_pitch'], heading,
+        )
+        for rank, idx in enumerate(selected):
+            pose = [None if np.isnan(col[rank]) else float(col[rank]) for col in columns]
+            yield images[idx], dict(zip(
+                ('easting', 'northing', 'altitude', 'roll', 'pitch', 'heading'), pose))
+
+
+def pack(rows):
+    '''
+    Packs (id, time, easting, northing, altitude, roll, pitch, heading)
+    rows in the binary pose format, time being an epoch in seconds.
+    Missing values are stored as NaN.
+    '''
+    rows = list(rows)
+    columns = list(zip(*rows)) if rows else [()] * len(BINARY_COLUMNS)
+    header = BINARY_MAGIC + np.array([BINARY_VERSION, len(rows)], dtype='<u4').tobytes()
+    return header + b''.join(
+        np.array([np.nan if value is None else value for value in column], dtype=dtype).tobytes()
+        for column, (_, dtype) in zip(columns, BINARY_COLUMNS)
+    )
+
+
+def unpack(data):
+    '''
+    Reads the binary pose format, returns a dict of arrays by column name
+    '''
+    if data[:8] != BINARY_MAGIC:
+        raise ValueError('not a binary pose document')
+    version, count = np.frombuffer(data, dtype='<u4', count=2, offset=8)
+    if version != BINARY_VERSION:
+        raise ValueError('unsupported binary pose version {}'.format(version))
+    offset = 16
+    columns = {}
+    for name, dtype in BINARY_COLUMNS:
+        columns[name] = np.frombuffer(data, dtype=dtype, count=int(count), offset=offset)
+        offset += columns[name].nbytes
+    return columns
+
+
+def route_patches(project, posdatasource, start=None, end=None, dimensions=DIMENSIONS):
+    '''
+    Reads and decodes the route patches of a positional datasource,
+    optionally only those overlapping the [start, end] epochs range.
+    m_time is always read along with the given dimensions, as float8
+    so that the arrays are built from floats rather than decimals
+    '''
+    rows = Database.query(
+        """
+        select
+            extract(epoch from r.start_time) as start_epoch,
+            extract(epoch from r.end_time) as end_epoch,
+            array_agg(pc_get(pt, 'm_time')::float8) as m_time,
+            {}
+        from %(project)s.route r, lateral pc_explode(r.points) as pt
+        where r.posdatasource = %(posdatasource)s
+        and (%(start)s::float8 is null or r.end_time >= to_timestamp(%(start)s::float8))
+        and (%(end)s::float8 is null or r.start_time <= to_timestamp(%(end)s::float8))
+        group by r.id, r.start_time, r.end_time
+        order by r.start_time
+        """.format(', '.join(
+            "array_agg(pc_get(pt, '{0}')::float8) as \"{0}\"".format(dim) for dim in dimensions)),
+        {'project': AsIs(project), 'posdatasource': posdatasource,
+         'start': start, 'end': end}
+    )
+    patches = []
+    for row in rows:
+        patch = {
+            dim: np.array(getattr(row, dim), dtype=float)
+            for dim in ('m_time',) + tuple(dimensions)
+        }
+        patch['start'], patch['end'] = float(row.start_epoch), float(row.end_epoch)
+        patches.append(patch)
+    return patches
+
+
+def simplify(points, tolerance):
+    '''
+    Douglas-Peucker simplification of a line given as a (n, d) array,
+    distances are computed with the two first columns
+    '''
+    count = len(points)
+    if count < 3 or tolerance <= 0:
+        return points
+    keep = np.zeros(count, dtype=bool)
+    keep[0] = keep[-1] = True
+    xy = points[:, :2]
+    stack = [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        segment = xy[last] - xy[first]
+        inner = xy[first + 1:last] - xy[first]
+        length = np.hypot(segment[0], segment[1])
+        if length:
+            distances = np.abs(segment[0] * inner[:, 1] - segment[1] * inner[:, 0]) / length
+        else:
+            distances = np.hypot(inner[:, 0], inner[:, 1])
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = first + 1 + farthest
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return points[keep]
+
+
+def route_line(patches):
+    '''
+    Returns the (x, y, z) points of decoded patches ordered by time
+    '''
+    if not patches:
+        return np.empty((0, 3))
+    times = np.concatenate([patch['m_time'] for patch in patches])
+    points = np.column_stack([
+        np.concatenate([patch[dim] for patch in patches]) for dim in ('x', 'y', 'z')
+    ])
+    return points[np.argsort(times, kind='mergesort')]
+
+
+def latest_posdatasource(project_id):
+    '''
+    Latest version of the route for a project (same rule as the images endpoint)
+    '''
+    res = Database.query("""
+        select max(pds.id) as id
+        from li3ds.session s
+        join li3ds.posdatasource pds on pds.session = s.id
+        where s.project = %s
+        """, (project_id, ))
+    return res[0].id if res else None
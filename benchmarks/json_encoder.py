@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Compares the json encoders on payloads like the api responses:
+encode time (best of several runs) and peak memory allocated.
+
+    python benchmarks/json_encoder.py [--repeat 5]
+'''
+import argparse
+import json
+import tracemalloc
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from timeit import repeat
+
+from psycopg2.extras import DateTimeTZRange
+
+from api_li3ds import encoder
+
+START = datetime(2016, 5, 12, 10, tzinfo=timezone.utc)
+
+
+def sensors(count=10000):
+    '''marshalled sensors list with json specifications'''
+    return [
+        OrderedDict([
+            ('id', idx),
+            ('name', 'sensor {}'.format(idx)),
+            ('serial_number', 'SN{:08d}'.format(idx)),
+            ('brand', 'brand'),
+            ('model', 'model'),
+            ('description', 'a camera of the platform'),
+            ('type', 'camera'),
+            ('specifications', {'size_x': 2048, 'size_y': 2048, 'focal': 1543.25, 'pixels': [0.1] * 8}),
+        ])
+        for idx in range(count)
+    ]
+
+
+def images(count=100000):
+    '''itowns image poses, numeric values as returned by pc_get'''
+    return [
+        {
+            'id': idx,
+            'filename': 'image_{}.jpg'.format(idx),
+            'date': START + timedelta(seconds=idx * .2),
+            'sensor': idx % 5,
+            'easting': Decimal('651234.125') + idx,
+            'northing': Decimal('6861234.5'),
+            'altitude': Decimal('40.25'),
+            'roll': Decimal('0.51'),
+            'pitch': Decimal('-1.2'),
+            'heading': Decimal('181.75'),
+        }
+        for idx in range(count)
+    ]
+
+
+def datasources(count=20000):
+    '''rows with timestamp ranges'''
+    return [
+        {
+            'id': idx,
+            'uri': 'file:///data/{}.bin'.format(idx),
+            'referential': idx,
+            'session': 1,
+            'time': DateTimeTZRange(START, START + timedelta(hours=1)),
+        }
+        for idx in range(count)
+    ]
+
+
+def stdlib(data):
+    return json.dumps(data, default=encoder.default)
+
+
+ENCODERS = [('json', stdlib)]
+if encoder.orjson is not None:
+    ENCODERS.append(('orjson', lambda data: encoder.orjson.dumps(
+        data, default=encoder.default, option=encoder.ORJSON_OPTIONS)))
+
+
+def peak_memory(func, data):
+    tracemalloc.start()
+    try:
+        func(data)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print('{:<12} {:<8} {:>10} {:>12} {:>10}'.format('payload', 'encoder', 'time (ms)', 'peak (MiB)', 'size (MB)'))
+    for name, build in (('sensors', sensors), ('images', images), ('datasources', datasources)):
+        data = build()
+        for label, func in ENCODERS:
+            best = min(repeat(lambda: func(data), number=1, repeat=args.repeat))
+            print('{:<12} {:<8} {:>10.1f} {:>12.1f} {:>10.1f}'.format(
+                name, label, best * 1000, peak_memory(func, data) / 2 ** 20, len(func(data)) / 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -10,7 +10,8 @@ requirements = (
     'flask-restplus==0.10.0',
     'psycopg2==2.6.2',
     'pyyaml',
-    'graphviz>=0.5.1'
+    'graphviz>=0.5.1',
+    'numpy',
 )
 
 dev_requirements = (
@@ -27,6 +28,11 @@ doc_requirements = (
     'sphinx_rtd_theme',
 )
 
+fast_requirements = (
+    'orjson',
+    'brotli',
+)
+
 prod_requirements = (
     'uwsgi'
 )
@@ -69,6 +75,7 @@ setup(
     extras_require={
         'dev': dev_requirements,
         'prod': prod_requirements,
-        'doc': doc_requirements
+        'doc': doc_requirements,
+        'fast': fast_requirements,
     }
 )
@@ -36,6 +36,18 @@ def doc(ctx):
     run('cd {0}/doc && make html'.format(HERE), pty=True)
 
 
+@task
+def bench(ctx):
+    '''Run the json encoders benchmark'''
+    run('cd {0} && PYTHONPATH={0} python benchmarks/json_encoder.py'.format(HERE), pty=True)
+
+
+@task
+def notify(ctx, database='li3ds'):
+    '''Install the change notification triggers'''
+    run('psql -d {0} -f {1}/api_li3ds/sql/notify.sql'.format(database, HERE), pty=True)
+
+
 @task
 def dist(ctx):
     '''Package for distribution'''
@@ -1,6 +1,16 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import json
+
+import pytest
 from flask import url_for
+from flask_restplus import marshal
+from werkzeug.exceptions import HTTPException
+
+from api_li3ds import expand
+from api_li3ds.app import marshal_with, requested_fields, select_list
+from api_li3ds.apis.sensor import sensor_model
+from api_li3ds.apis.session import session_model
 
 
 def test_get_projects(client):
@@ -43,3 +53,177 @@ def test_get_transfos(client):
     resp = client.get(url_for('transfos'))
     assert resp.content_type == 'application/json'
     assert resp.status_code == 200
+
+
+def test_get_monitoring_pool(client):
+    resp = client.get(url_for('monitoring_pool'))
+    assert resp.content_type == 'application/json'
+    assert resp.status_code == 200
+    assert resp.json['used'] >= 0
+
+
+def test_get_sensors_page(client):
+    resp = client.get(url_for('sensors', limit=1))
+    assert resp.status_code == 200
+    assert len(resp.json) <= 1
+    if 'X-Next-Cursor' in resp.headers:
+        after = int(resp.headers['X-Next-Cursor'])
+        resp = client.get(url_for('sensors', limit=1, after=after))
+        assert all(sensor['id'] > after for sensor in resp.json)
+
+
+def test_get_sensors_bad_limit(client):
+    resp = client.get(url_for('sensors', limit=0))
+    assert resp.status_code == 400
+
+
+def test_json_passthrough(app, client):
+    for endpoint in ('platforms', 'sensors', 'referentials', 'transfos', 'sessions'):
+        expected = client.get(url_for(endpoint)).json
+        app.config['json_passthrough'] = True
+        resp = client.get(url_for(endpoint))
+        app.config['json_passthrough'] = False
+        assert resp.status_code == 200
+        assert resp.json == expected
+
+
+def test_get_metrics(client):
+    client.get(url_for('sensors'))
+    resp = client.get('/metrics')
+    assert resp.status_code == 200
+    assert b'li3ds_query_duration_seconds_bucket' in resp.data
+
+
+def test_bulk_datasources_expects_array(app, client):
+    resp = client.post(
+        url_for('datasources_bulk'), data='{"referential": 1, "session": 1}',
+        content_type='application/json',
+        headers={'X-API-KEY': app.config['HEADER_API_KEY']})
+    assert resp.status_code == 400
+
+
+def test_images_refresh_requires_api_key(client):
+    resp = client.post(url_for('images_refresh'))
+    assert resp.status_code == 401
+
+
+def test_session_poses_expects_times(client):
+    resp = client.post(
+        url_for('session_poses', session_id=1), data='{}', content_type='application/json')
+    assert resp.status_code == 400
+
+
+def test_get_sensors_not_modified(client):
+    resp = client.get(url_for('sensors'))
+    assert resp.status_code == 200
+    etag = resp.headers['ETag']
+    resp = client.get(url_for('sensors'), headers={'If-None-Match': etag})
+    assert resp.status_code == 304
+    assert resp.headers['ETag'] == etag
+
+
+def test_get_sensors_by_ids(client):
+    ids = [sensor['id'] for sensor in client.get(url_for('sensors', limit=2)).json]
+    missing = max(ids + [0]) + 1000000
+    resp = client.get(url_for('sensors', ids=','.join(map(str, ids[::-1] + [missing] + ids))))
+    assert resp.status_code == 200
+    assert [sensor['id'] for sensor in resp.json] == ids[::-1] + ids
+    assert resp.headers['X-Missing-Ids'] == str(missing)
+    assert resp.headers['X-Missing-Count'] == '1'
+
+
+def test_get_sensors_bad_ids(client):
+    resp = client.get(url_for('sensors', ids='1,a'))
+    assert resp.status_code == 400
+
+
+def test_lookup_sensors(client):
+    resp = client.post(
+        url_for('sensors_lookup'), data='{"ids": [-1]}', content_type='application/json')
+    assert resp.status_code == 200
+    assert resp.json == []
+    assert resp.headers['X-Missing-Ids'] == '-1'
+
+
+def test_lookup_sensors_missing_truncated(client):
+    max_missing = client.application.config.get('missing_ids_max', 100)
+    ids = list(range(-1, -max_missing - 11, -1))
+    resp = client.post(
+        url_for('sensors_lookup'), data=json.dumps({'ids': ids}),
+        content_type='application/json')
+    assert resp.status_code == 200
+    assert resp.headers['X-Missing-Count'] == str(len(ids))
+    assert len(resp.headers['X-Missing-Ids'].split(',')) == max_missing
+    assert resp.headers['X-Missing-Ids-Truncated'] == 'true'
+
+
+def test_requested_fields(app):
+    with app.test_request_context('/'):
+        assert requested_fields(sensor_model) is None
+        assert select_list(sensor_model) == '*'
+        assert select_list(sensor_model, 's') == 's.*'
+    with app.test_request_context('/?fields=type, short_name,type'):
+        assert requested_fields(sensor_model) == ['short_name', 'type']
+        assert select_list(sensor_model) == '"id", "short_name", "type"'
+        assert select_list(sensor_model, 's', key=None) == 's."short_name", s."type"'
+    with app.test_request_context('/?fields=short_name,id,type'):
+        assert select_list(sensor_model) == '"id", "short_name", "type"'
+
+
+@pytest.mark.parametrize('fields', ['', 'id,color', 'id;drop table'])
+def test_requested_fields_invalid(app, fields):
+    with app.test_request_context('/?fields=' + fields):
+        with pytest.raises(HTTPException) as error:
+            requested_fields(sensor_model)
+    assert error.value.code == 400
+
+
+def test_marshal_fields(app):
+    @marshal_with(sensor_model)
+    def get():
+        return [{'id': 1, 'type': 'camera'}]
+
+    with app.test_request_context('/?fields=id,type'):
+        assert get() == [{'id': 1, 'type': 'camera'}]
+
+
+def test_requested_relations(app):
+    with app.test_request_context('/?expand=platform,datasources.referential.sensor'):
+        tree = expand.requested_relations('session')
+    assert tree == {'platform': {}, 'datasources': {'referential': {'sensor': {}}}}
+    with app.test_request_context('/'):
+        assert expand.requested_relations('session') == {}
+
+
+@pytest.mark.parametrize('path', [
+    'sensor', 'datasources.platform', 'datasources.session.datasources.referential'
+])
+def test_requested_relations_invalid(app, path):
+    with app.test_request_context('/?expand=' + path):
+        with pytest.raises(HTTPException) as error:
+            expand.requested_relations('session')
+    assert error.value.code == 400
+
+
+def test_jsonb_sql():
+    tree = {'platform': {}, 'datasources': {'referential': {}}}
+    sql = expand.jsonb_sql('session', 't', tree, columns=['id', 'name'])
+    assert sql.startswith(
+        "jsonb_build_object('id', t.\"id\", 'name', t.\"name\") || jsonb_build_object("
+        "'platform', (select to_jsonb(t1) from li3ds.platform t1 where t1.id = t.platform), ")
+    assert ("(select coalesce(jsonb_agg(to_jsonb(t1) || jsonb_build_object('referential', "
+            "(select to_jsonb(t2) from li3ds.referential t2 where t2.id = t1.referential)) "
+            "order by t1.id), '[]') from li3ds.datasource t1 where t1.session = t.id)") in sql
+
+
+def test_expanded_fields():
+    tree = {'platform': {}, 'datasources': {'referential': {}}}
+    fields = expand.expanded_fields('session', session_model, tree)
+    row = {
+        'id': 1, 'name': 'session', 'platform': None,
+        'datasources': [{'id': 2, 'uri': 'file', 'referential': {'id': 3, 'srid': 0}}],
+    }
+    data = marshal(row, fields)
+    assert data['platform'] is None
+    assert data['datasources'][0]['uri'] == 'file'
+    assert data['datasources'][0]['referential']['srid'] == 0
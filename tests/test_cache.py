@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+
+from api_li3ds.cache import DiskCache, content_key
+
+
+def test_content_key():
+    assert content_key([1, 2], 'a') == content_key([1, 2], 'a')
+    assert content_key([1, 2], 'a') != content_key([2, 1], 'a')
+
+
+def test_disk_cache(tmpdir):
+    cache = DiskCache(str(tmpdir), 100)
+    assert cache.get('a') is None
+    cache.set('a', b'data')
+    assert cache.get('a') == b'data'
+
+
+def test_disk_cache_eviction(tmpdir):
+    cache = DiskCache(str(tmpdir), 100)
+    cache.set('old', b'x' * 60)
+    os.utime(str(tmpdir.join('old')), (0, 0))
+    cache.set('new', b'x' * 60)
+    assert cache.get('old') is None
+    assert cache.get('new') == b'x' * 60
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from api_li3ds.changes import ChangeListener, PRUNE_INTERVAL
+
+
+def test_changed():
+    listener = ChangeListener()
+    calls = []
+    listener.subscribe(lambda: calls.append('sensor'), 'sensor', 'referential')
+    listener.subscribe(lambda: calls.append('transfo'), 'transfo')
+
+    listener.changed('sensor', 3)
+    listener.changed('sensor', 3)
+    listener.changed('referential', 1)
+    listener.changed('session', 2)
+    assert calls == ['sensor', 'sensor']
+    assert listener.generation('sensor') == 3
+    assert listener.generation('transfo') == 0
+    assert listener.generations() == {'sensor': 3, 'referential': 1, 'session': 2}
+
+
+def test_failing_callback():
+    listener = ChangeListener()
+    calls = []
+
+    def fail():
+        raise RuntimeError
+
+    listener.subscribe(fail, 'sensor')
+    listener.subscribe(lambda: calls.append(1), 'sensor')
+    listener.changed('sensor', 1)
+    assert calls == [1]
+
+
+class Cursor():
+
+    def __init__(self, statements):
+        self.statements = statements
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query):
+        self.statements.append(query)
+
+    def fetchall(self):
+        if 'li3ds.table_change' in self.statements[-1]:
+            return [('sensor', 4)]
+        return [('sensor',)]
+
+
+class Connection():
+
+    def __init__(self):
+        self.statements = []
+
+    def cursor(self):
+        return Cursor(self.statements)
+
+
+def test_listen_before_reading_generations():
+    listener = ChangeListener()
+    conn = Connection()
+    listener._listen(conn)
+    statements = [' '.join(statement.split()) for statement in conn.statements]
+    assert statements[0].startswith('select distinct event_object_table')
+    assert statements[1] == 'listen "li3ds_sensor"'
+    assert statements[2].startswith('select table_name, max(generation)')
+    assert statements[3].startswith('delete from li3ds.table_change')
+    assert listener.generation('sensor') == 4
+    assert listener.active
+
+
+def test_prune_interval():
+    listener = ChangeListener()
+    conn = Connection()
+    listener._listen(conn)
+    listener._ping(conn)
+    assert not any(statement.lstrip().startswith('delete') for statement in conn.statements[4:])
+    listener._pruned -= PRUNE_INTERVAL + 1
+    listener._ping(conn)
+    assert conn.statements[-1].lstrip().startswith('delete')
+
+
+def test_inactive_without_answer():
+    listener = ChangeListener()
+    listener._listen(Connection())
+    listener._alive -= 3 * listener.timeout
+    assert not listener.active
+
+
+def test_written_pending():
+    listener = ChangeListener()
+    listener.changed('sensor', 1)
+    before = listener.snapshot(['sensor', 'transfo'])
+    listener.written(before)
+    assert listener.pending('sensor')
+    assert listener.pending('transfo')
+    listener.changed('sensor', 2)
+    assert not listener.pending('sensor')
+    assert listener.pending('transfo')
+
+
+def test_written_already_notified():
+    listener = ChangeListener()
+    before = listener.snapshot(['sensor'])
+    # notification received before the request ended
+    listener.changed('sensor', 1)
+    listener.written(before)
+    assert not listener.pending('sensor')
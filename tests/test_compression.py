@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import gzip
+import os
+
+import pytest
+from flask import Flask, Response
+
+from api_li3ds.cache import DiskCache
+from api_li3ds.compression import (
+    Compression, Payload, cached_response, negotiate, ENCODINGS
+)
+
+app = Flask(__name__, instance_path=os.path.dirname(__file__))
+app.config['compression_min_size'] = 100
+compression = Compression()
+
+BODY = b'{"id": 1, "name": "camera"}' * 20
+
+
+@pytest.mark.parametrize('accept, encodings, expected', [
+    (None, ('gzip',), None),
+    ('gzip, deflate', ('gzip',), 'gzip'),
+    ('identity', ('gzip',), None),
+    ('gzip;q=0', ('gzip',), None),
+    ('*', ('gzip',), 'gzip'),
+    ('gzip', (), None),
+])
+def test_negotiate(accept, encodings, expected):
+    headers = {'Accept-Encoding': accept} if accept else {}
+    app.config['compression_encodings'] = encodings
+    try:
+        with app.test_request_context('/', headers=headers):
+            assert negotiate() == expected
+    finally:
+        del app.config['compression_encodings']
+
+
+def test_compress_response():
+    with app.test_request_context('/', headers={'Accept-Encoding': 'gzip'}):
+        app.config['compression_encodings'] = ('gzip',)
+        try:
+            resp = Response(BODY, mimetype='application/json')
+            resp.set_etag('abc')
+            resp = compression.after_request(resp)
+            small = compression.after_request(Response(b'{}', mimetype='application/json'))
+            png = compression.after_request(Response(BODY, mimetype='image/png'))
+        finally:
+            del app.config['compression_encodings']
+    assert resp.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in resp.vary
+    assert resp.get_etag() == ('abc', True)
+    assert gzip.decompress(resp.get_data()) == BODY
+    assert 'Content-Encoding' not in small.headers
+    assert 'Content-Encoding' not in png.headers
+
+
+def test_compress_stream():
+    with app.test_request_context('/', headers={'Accept-Encoding': 'gzip'}):
+        app.config['compression_encodings'] = ('gzip',)
+        try:
+            resp = compression.after_request(
+                Response(iter(['[', '{"id": 1}', ']']), mimetype='application/json'))
+            data = resp.get_data()
+        finally:
+            del app.config['compression_encodings']
+    assert resp.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(data) == b'[{"id": 1}]'
+
+
+@pytest.mark.parametrize('encoding', ENCODINGS)
+def test_payload(encoding):
+    payload = Payload(BODY)
+    with app.test_request_context('/', headers={'Accept-Encoding': encoding}):
+        first = payload.response()
+        second = payload.response()
+    with app.test_request_context('/'):
+        plain = payload.response()
+    assert first.headers['Content-Encoding'] == encoding
+    assert first.get_data() == second.get_data()
+    assert len(first.get_data()) < len(BODY)
+    assert list(payload._variants) == [encoding]
+    assert plain.get_data() == BODY
+    assert 'Content-Encoding' not in plain.headers
+
+
+def test_cached_response(tmpdir):
+    cache = DiskCache(str(tmpdir), 10000)
+    calls = []
+
+    def build():
+        calls.append(1)
+        return BODY
+
+    app.config['compression_encodings'] = ('gzip',)
+    try:
+        with app.test_request_context('/', headers={'Accept-Encoding': 'gzip'}):
+            resp = cached_response(cache, 'key', build)
+            cached_response(cache, 'key', build)
+        with app.test_request_context('/'):
+            plain = cached_response(cache, 'key', build)
+    finally:
+        del app.config['compression_encodings']
+    assert calls == [1]
+    assert gzip.decompress(resp.get_data()) == BODY
+    assert cache.get('key.gzip') == resp.get_data()
+    assert plain.get_data() == BODY
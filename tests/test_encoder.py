@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import os
+from datetime import datetime, date, timedelta, timezone
+from decimal import Decimal
+
+import numpy as np
+import pytest
+from flask import Flask
+from psycopg2.extras import DateTimeTZRange, NumericRange
+
+from api_li3ds import encoder
+
+app = Flask(__name__, instance_path=os.path.dirname(__file__))
+
+DATA = {
+    'date': datetime(2016, 5, 12, 10, 0, 0, 250000, tzinfo=timezone(timedelta(hours=2))),
+    'day': date(2016, 5, 12),
+    'value': Decimal('651234.125'),
+    'range': DateTimeTZRange(datetime(2016, 5, 12, tzinfo=timezone.utc), None, '[)'),
+    'empty': NumericRange(empty=True),
+    'array': np.arange(3),
+    1: 'int key',
+}
+
+EXPECTED = {
+    'date': '2016-05-12T10:00:00.250000+02:00',
+    'day': '2016-05-12',
+    'value': 651234.125,
+    'range': {'lower': '2016-05-12T00:00:00+00:00', 'upper': None, 'bounds': '[)'},
+    'empty': {'empty': True},
+    'array': [0, 1, 2],
+    '1': 'int key',
+}
+
+
+@pytest.mark.parametrize('setting', ['json', 'orjson'])
+def test_dumps(setting):
+    if setting == 'orjson' and encoder.orjson is None:
+        pytest.skip('orjson is not installed')
+    app.config['json_encoder'] = setting
+    with app.app_context():
+        assert encoder.use_orjson() == (setting == 'orjson')
+        assert json.loads(encoder.dumps(DATA)) == EXPECTED
+
+
+def test_dumps_settings():
+    with app.app_context():
+        assert encoder.dumps({'b': 1, 'a': 2}, sort_keys=True, indent=1) == '{\n "a": 2,\n "b": 1\n}'
+
+
+def test_unknown_type():
+    with app.app_context():
+        with pytest.raises(TypeError):
+            encoder.dumps({'value': object()})
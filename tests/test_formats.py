@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import os
+
+import pytest
+from flask import Flask
+from werkzeug.exceptions import HTTPException
+
+from api_li3ds.app import output_format, stream_ndjson, stream_geojson
+from api_li3ds.apis.itowns import image_feature
+
+app = Flask(__name__, instance_path=os.path.dirname(__file__))
+
+
+@pytest.mark.parametrize('path, accept, expected', [
+    ('/', None, 'json'),
+    ('/', '*/*', 'json'),
+    ('/', 'application/x-ndjson', 'ndjson'),
+    ('/', 'application/geo+json, application/json;q=0.5', 'geojson'),
+    ('/?format=ndjson', 'application/json', 'ndjson'),
+])
+def test_output_format(path, accept, expected):
+    headers = {'Accept': accept} if accept else {}
+    with app.test_request_context(path, headers=headers):
+        assert output_format() == expected
+
+
+def test_output_format_unknown():
+    with app.test_request_context('/?format=xml'):
+        with pytest.raises(HTTPException):
+            output_format()
+
+
+def test_stream_ndjson():
+    with app.test_request_context('/'):
+        resp = stream_ndjson(iter([{'id': 1}, {'id': 2}]))
+        lines = resp.get_data(as_text=True).splitlines()
+    assert resp.mimetype == 'application/x-ndjson'
+    assert [json.loads(line) for line in lines] == [{'id': 1}, {'id': 2}]
+
+
+def test_stream_geojson():
+    image = {'id': 1, 'filename': 'a.jpg', 'easting': 1., 'northing': 2.,
+             'altitude': 3., 'heading': 10.}
+    with app.test_request_context('/'):
+        resp = stream_geojson(image_feature(row) for row in [image, dict(image, easting=None)])
+        collection = json.loads(resp.get_data(as_text=True))
+    assert collection['type'] == 'FeatureCollection'
+    first, second = collection['features']
+    assert first['geometry'] == {'type': 'Point', 'coordinates': [1., 2., 3.]}
+    assert first['properties'] == {'id': 1, 'filename': 'a.jpg', 'heading': 10.}
+    assert second['geometry'] is None
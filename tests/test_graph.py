@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from datetime import datetime
+
+from api_li3ds.graph import TransfoGraph
+
+# camera (1) -> 2 -> 4 -> ins root (3), with a shortcut 15 from 2 to 3
+# valid in 2016 only, a transfo 13 going back from 3 to 2
+# and a lonely referential 5
+TRANSFOS = [
+    (10, 1, 2, None, None),
+    (11, 2, 4, None, None),
+    (12, 4, 3, None, None),
+    (13, 3, 2, None, None),
+    (14, 5, 6, None, None),
+    (15, 2, 3, datetime(2016, 1, 1), datetime(2016, 12, 31)),
+]
+REFERENTIALS = [(1, False, 'camera'), (2, False, None), (3, True, 'ins'), (4, False, None)]
+
+
+def test_path():
+    graph = TransfoGraph(TRANSFOS, REFERENTIALS)
+    assert graph.path(1, 3) == [10, 15]
+    assert graph.path(1, 1) == []
+    assert graph.path(1, 5) is None
+
+
+def test_path_direction():
+    graph = TransfoGraph(TRANSFOS, REFERENTIALS)
+    assert graph.path(3, 1) is None
+    assert graph.path(3, 4) == [13, 11]
+
+
+def test_path_validity():
+    graph = TransfoGraph(TRANSFOS, REFERENTIALS)
+    assert graph.path(1, 3, datetime(2016, 5, 1), datetime(2016, 5, 2)) == [10, 15]
+    assert graph.path(1, 3, datetime(2017, 5, 1), datetime(2017, 5, 2)) == [10, 11, 12]
+    assert graph.path(1, 3, None, datetime(2015, 5, 2)) == [10, 11, 12]
+
+
+def test_paths():
+    graph = TransfoGraph(TRANSFOS, REFERENTIALS)
+    assert graph.paths([1, 4, 5], 3) == {1: [10, 15], 4: [12], 5: None}
+
+
+def test_roots():
+    graph = TransfoGraph(TRANSFOS, REFERENTIALS)
+    assert graph.roots() == [3]
+    assert graph.roots('ins') == [3]
+    assert graph.roots('camera') == []
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+from collections import namedtuple
+
+import pytest
+from flask import Flask
+from werkzeug.exceptions import HTTPException
+
+from api_li3ds.apis.itowns import filter_query, filter_poses, image_filters
+
+app = Flask(__name__, instance_path=os.path.dirname(__file__))
+
+Image = namedtuple('Image', 'id epoch')
+
+
+def pose(easting, northing):
+    return {'easting': easting, 'northing': northing}
+
+
+POSES = [
+    (Image(1, 10.), pose(0., 0.)),
+    (Image(2, 20.), pose(5., 5.)),
+    (Image(3, 30.), pose(10., 10.)),
+    (Image(4, 40.), pose(None, None)),
+]
+
+
+def test_filter_query():
+    assert filter_query('select 1', {}) == 'select t.* from (select 1) as t order by t.id'
+    query = filter_query('select 1', {
+        'xmin': 0, 'ymin': 0, 'xmax': 1, 'ymax': 1, 'start': 0, 'near_x': 0, 'near_y': 0, 'k': 1})
+    assert 'st_makeenvelope(%(xmin)s, %(ymin)s, %(xmax)s, %(ymax)s)' in query
+    assert 't.date >= to_timestamp(%(start)s)' in query
+    assert 'end' not in query
+    assert query.endswith('<-> st_makepoint(%(near_x)s, %(near_y)s) limit %(k)s')
+
+
+def test_filter_poses():
+    def ids(filters):
+        return [image.id for image, _ in filter_poses(iter(POSES), filters)]
+
+    assert ids({}) == [1, 2, 3, 4]
+    assert ids({'start': 15., 'end': 30.}) == [2, 3]
+    assert ids({'xmin': 1., 'ymin': 1., 'xmax': 10., 'ymax': 10.}) == [2, 3]
+    assert ids({'near_x': 9., 'near_y': 9., 'k': 2}) == [3, 2]
+
+
+@pytest.mark.parametrize('query', [
+    'bbox=1,2,3', 'bbox=3,0,1,1', 'near=a,b', 'near=1,1&k=0',
+])
+def test_image_filters_invalid(query):
+    with app.test_request_context('/?' + query):
+        with pytest.raises(HTTPException):
+            image_filters()
+
+
+def test_image_filters():
+    with app.test_request_context('/?bbox=0,1,2,3&near=4,5&k=100000'):
+        filters = image_filters()
+    assert filters['xmin'] == 0 and filters['ymax'] == 3
+    assert (filters['near_x'], filters['near_y'], filters['k']) == (4, 5, 1000)
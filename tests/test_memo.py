@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+
+from flask import Flask
+
+from api_li3ds.memo import Memo
+
+app = Flask(__name__, instance_path=os.path.dirname(__file__))
+
+
+def test_memo():
+    calls = []
+
+    def compute(value):
+        calls.append(value)
+        return value
+
+    memo = Memo('memo_ttl', maxsize=2)
+    with app.app_context():
+        assert memo.get((1, 1), lambda: compute('a')) == 'a'
+        assert memo.get((1, 1), lambda: compute('b')) == 'a'
+        memo.invalidate((1, 1))
+        assert memo.get((1, 1), lambda: compute('c')) == 'c'
+        memo.get((2, 1), lambda: compute('d'))
+        memo.get((3, 1), lambda: compute('e'))
+        # least recently used key dropped
+        assert memo.get((1, 1), lambda: compute('f')) == 'f'
+        memo.invalidate()
+        assert memo.get((3, 1), lambda: compute('g')) == 'g'
+    assert calls == ['a', 'c', 'd', 'e', 'f', 'g']
+
+
+def test_memo_ttl():
+    memo = Memo('memo_ttl')
+    app.config['memo_ttl'] = 0
+    try:
+        with app.app_context():
+            memo.get('key', lambda: 1)
+            assert memo.get('key', lambda: 2) == 2
+    finally:
+        del app.config['memo_ttl']
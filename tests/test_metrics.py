@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from api_li3ds.metrics import Metrics, fingerprint
+
+
+def test_fingerprint_ignores_whitespaces():
+    assert fingerprint("select *\n  from li3ds.sensor") == fingerprint("select * from li3ds.sensor")
+
+
+def test_render_histogram():
+    metrics = Metrics()
+    metrics.observe('li3ds_request_duration_seconds', 0.02, endpoint='sensors')
+    metrics.observe('li3ds_request_duration_seconds', 3, endpoint='sensors')
+    text = metrics.render()
+    assert '# TYPE li3ds_request_duration_seconds histogram' in text
+    assert 'li3ds_request_duration_seconds_bucket{endpoint="sensors",le="0.025"} 1' in text
+    assert 'li3ds_request_duration_seconds_bucket{endpoint="sensors",le="+Inf"} 2' in text
+    assert 'li3ds_request_duration_seconds_count{endpoint="sensors"} 2' in text
+
+
+def test_render_counter_and_collector():
+    metrics = Metrics()
+    metrics.inc('li3ds_response_bytes_total', 10, endpoint='sensors')
+    metrics.inc('li3ds_response_bytes_total', 5, endpoint='sensors')
+    metrics.collector(lambda: [('li3ds_pool_size', 'gauge', 'pool size', 3)])
+    text = metrics.render()
+    assert 'li3ds_response_bytes_total{endpoint="sensors"} 15' in text
+    assert 'li3ds_pool_size 3' in text
+
+
+def test_fingerprint_ignores_select_lists():
+    queries = [
+        'select * from li3ds.sensor where id=%s',
+        'select "id", "name" from li3ds.sensor where id=%s',
+        'select s."id", s."type" from li3ds.sensor where id=%s',
+    ]
+    assert len(set(fingerprint(query) for query in queries)) == 1
+    assert fingerprint('select id from li3ds.sensor where id=%s') != fingerprint(queries[0])
+    expanded = [
+        "select to_jsonb(t) || jsonb_build_object('platform', (select to_jsonb(t1) "
+        "from li3ds.platform t1 where t1.id = t.platform)) from li3ds.session t",
+        "select jsonb_build_object('id', t.\"id\") from li3ds.session t",
+        "select to_jsonb(t) from li3ds.session t",
+    ]
+    assert len(set(fingerprint(query) for query in expanded)) == 1
+    passthrough = "select coalesce(json_agg(json_build_object({})), '[]')::text from t"
+    assert fingerprint(passthrough.format("'id', id")) == fingerprint(
+        passthrough.format("'id', id, 'name', coalesce(name, '')"))
+
+
+def test_max_queries():
+    metrics = Metrics()
+    metrics.max_queries = 2
+    for table in ('sensor', 'session', 'platform', 'sensor'):
+        metrics.observe_query('select * from li3ds.{}'.format(table), 0.01)
+    assert len(metrics.queries()) == 2
+    text = metrics.render()
+    assert 'query="other"' in text
+    assert text.count('li3ds_query_duration_seconds_count') == 3
+
+
+def test_collector_registered_once():
+    metrics = Metrics()
+
+    def collect():
+        return [('li3ds_pool_size', 'gauge', 'pool size', 3)]
+
+    metrics.collector(collect)
+    metrics.collector(collect)
+    assert metrics.render().count('# TYPE li3ds_pool_size gauge') == 1
+
+
+def test_count_stream():
+    metrics = Metrics()
+    chunks = metrics.count_stream(iter([b'[', b'{"id": 1}', b']']), endpoint='sensors')
+    assert 'li3ds_response_bytes_total' not in metrics.render()
+    assert b''.join(chunks) == b'[{"id": 1}]'
+    assert 'li3ds_response_bytes_total{endpoint="sensors"} 11' in metrics.render()
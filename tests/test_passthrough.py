@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import pytest
+
+from api_li3ds import passthrough
+from api_li3ds.apis.sensor import sensor_model
+from api_li3ds.apis.transfo import transfo_model
+from api_li3ds.apis.project import project_model
+
+
+def test_json_object():
+    sql = passthrough.json_object(sensor_model)
+    assert sql.startswith("json_build_object('id', t.\"id\", ")
+    assert "'specifications', t.\"specifications\"" in sql
+
+
+def test_json_object_datetime():
+    sql = passthrough.json_object(transfo_model)
+    assert "to_char(t.\"tdate\", 'YYYY-MM-DD\"T\"HH24:MI:SS')" in sql
+
+
+def test_unsupported_model():
+    assert not passthrough.supported(project_model)
+    with pytest.raises(passthrough.UnsupportedModel):
+        passthrough.json_object(project_model)
+
+
+def test_json_object_fields():
+    sql = passthrough.json_object(sensor_model, ['id', 'type'])
+    assert sql == "json_build_object('id', t.\"id\", 'type', t.\"type\"::text)"
+    # the extent geometry is not needed
+    assert passthrough.supported(project_model, ['id', 'name'])
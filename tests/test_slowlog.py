@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from psycopg2 import Error as PsycoError
+from psycopg2.extensions import AsIs
+
+from api_li3ds.slowlog import redact, SlowQueryLog
+
+
+def test_redact():
+    assert redact({'project': AsIs('toulouse'), 'session': 3, 'uri': 'file:///a'}) == \
+        {'project': 'toulouse', 'session': '<int>', 'uri': '<str>'}
+    assert redact((1, 'a')) == ['<int>', '<str>']
+    assert redact(None) is None
+
+
+def test_explain_once_per_interval():
+    log = SlowQueryLog()
+    log.explain_interval = 60
+    assert log._should_explain('abc')
+    assert not log._should_explain('abc')
+    assert log._should_explain('def')
+
+
+class Failure(PsycoError):
+    pgerror = 'ERROR: syntax error'
+
+
+class Cursor():
+
+    def __init__(self, log):
+        self.log = log
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, parameters=None):
+        self.log.append(query)
+        if query.startswith('explain'):
+            raise Failure()
+
+
+class Connection():
+    autocommit = False
+
+    def __init__(self):
+        self.log = []
+
+    def cursor(self):
+        return Cursor(self.log)
+
+
+def test_explain_error_in_transaction():
+    conn = Connection()
+    plan = SlowQueryLog().explain(conn, 'select from', None)
+    assert plan == {'error': 'ERROR: syntax error'}
+    assert conn.log == [
+        'savepoint li3ds_explain',
+        'explain (analyze off, format json) select from',
+        'rollback to savepoint li3ds_explain',
+        'release savepoint li3ds_explain',
+    ]
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from collections import defaultdict, OrderedDict
+
+from psycopg2 import Error as PsycoError
+from psycopg2.extensions import AsIs
+
+from api_li3ds.statements import convert, execute
+
+
+def test_convert_positional():
+    assert convert("select * from li3ds.platform where id=%s", (3,)) == \
+        ("select * from li3ds.platform where id=$1", [3])
+
+
+def test_convert_named():
+    query, args = convert(
+        "select * from t where a = %(a)s and b > %(b)s or a is null and c like '%%x'",
+        {'a': 1, 'b': 2})
+    assert query == "select * from t where a = $1 and b > $2 or a is null and c like '%x'"
+    assert args == [1, 2]
+
+
+def test_convert_repeated_name():
+    query, args = convert("select %(a)s, %(b)s, %(a)s", {'a': 1, 'b': 2})
+    assert query == "select $1, $2, $1"
+    assert args == [1, 2]
+
+
+def test_convert_asis():
+    query, args = convert(
+        "select * from %(project)s.image where id = %(id)s",
+        {'project': AsIs('toulouse'), 'id': 4})
+    assert query == "select * from toulouse.image where id = $1"
+    assert args == [4]
+
+
+def test_convert_default_payload():
+    payload = defaultdict(lambda: None)
+    query, args = convert("values (%(name)s, %(owner)s)", payload)
+    assert query == "values ($1, $2)"
+    assert args == [None, None]
+
+
+def test_convert_without_parameters():
+    assert convert("select '%s'", None) == ("select '%s'", [])
+
+
+class Invalidated(PsycoError):
+    pgcode = '0A000'
+
+
+class Cursor():
+
+    def __init__(self, conn):
+        self.connection = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, args=None):
+        self.connection.log.append(query)
+        if query.startswith('execute') and self.connection.invalid:
+            self.connection.invalid = False
+            raise Invalidated()
+
+
+class Connection():
+
+    def __init__(self, autocommit):
+        self.autocommit = autocommit
+        self.statements = OrderedDict()
+        self.invalid = False
+        self.log = []
+
+    def cursor(self):
+        return Cursor(self)
+
+
+def test_execute_invalidated_in_transaction():
+    conn = Connection(autocommit=False)
+    cur = conn.cursor()
+    execute(cur, 'select 1')
+    name = conn.statements['select 1']
+    conn.invalid, conn.log = True, []
+    execute(cur, 'select 1')
+    renamed = conn.statements['select 1']
+    assert conn.log == [
+        'savepoint li3ds_execute',
+        'execute {}'.format(name),
+        'rollback to savepoint li3ds_execute',
+        'release savepoint li3ds_execute',
+        'deallocate {}'.format(name),
+        'savepoint li3ds_prepare',
+        'prepare {} as select 1'.format(renamed),
+        'release savepoint li3ds_prepare',
+        'execute {}'.format(renamed),
+    ]
+
+
+def test_execute_autocommit():
+    conn = Connection(autocommit=True)
+    execute(conn.cursor(), 'select 1')
+    assert conn.log == [
+        'prepare {} as select 1'.format(conn.statements['select 1']),
+        'execute {}'.format(conn.statements['select 1']),
+    ]
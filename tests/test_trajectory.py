@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from collections import namedtuple
+
+import numpy as np
+
+from api_li3ds.trajectory import interpolate, poses, pack, unpack, simplify, route_line
+
+Image = namedtuple('Image', 'id epoch')
+
+
+def patch(start, end, times, **values):
+    result = {'start': start, 'end': end, 'm_time': np.array(times, dtype=np.float64)}
+    for dim in ('x', 'y', 'z', 'm_roll', 'm_pitch', 'm_plateformHeading', 'm_wanderAngle'):
+        result[dim] = np.array(values.get(dim, [0.] * len(times)), dtype=np.float64)
+    return result
+
+
+def test_interpolate():
+    times = np.array([0., 10., 20.])
+    values = np.array([0., 100., 300.])
+    result = interpolate(np.array([-1., 0., 5., 15., 20., 21.]), times, values)
+    assert np.isnan(result[0]) and np.isnan(result[-1])
+    assert list(result[1:-1]) == [0., 50., 200., 300.]
+
+
+def test_interpolate_angles():
+    times = np.array([0., 10., 20.])
+    # no wrap: same as a plain interpolation
+    values = np.array([10., 20., 40.])
+    assert list(interpolate(np.array([5., 15.]), times, values, 360.)) == [15., 30.]
+    # wrap between 350 and 10 degrees goes through 0, not 180
+    values = np.array([340., 350., 10.])
+    result = interpolate(np.array([5., 15., 20.]), times, values, 360.)
+    assert np.allclose(result, [345., 360., 10.])
+
+
+def test_poses():
+    images = [Image(1, 5.), Image(2, 15.), Image(3, 30.), Image(4, 10.)]
+    patches = [
+        patch(0., 10., [0., 10.], x=[0., 10.], m_plateformHeading=[90., 90.],
+              m_wanderAngle=[10., 20.]),
+        patch(10., 20., [10., 18.], x=[10., 18.]),
+    ]
+    result = list(poses(images, patches))
+    assert [(image.id, pose['easting']) for image, pose in result] == [
+        (1, 5.), (2, 15.), (4, 10.)]
+    assert result[0][1]['heading'] == 75.
+    assert list(poses(images[:1], [])) == []
+
+
+def test_pack():
+    rows = [
+        (1, 1500000000.5, 651000.25, 6861000.5, 40.125, 1.5, -0.5, 90.),
+        (2, 1500000001.5, None, None, None, None, None, None),
+    ]
+    data = pack(rows)
+    assert len(data) == 16 + 2 * (5 * 8 + 3 * 4)
+    columns = unpack(data)
+    assert list(columns['id']) == [1, 2]
+    assert columns['time'][0] == 1500000000.5
+    assert columns['easting'][0] == 651000.25
+    assert columns['heading'].dtype == np.float32
+    assert np.isnan(columns['altitude'][1])
+    assert len(unpack(pack([]))['id']) == 0
+
+
+def test_simplify():
+    points = np.array([[0., 0., 0.], [1., 0.1, 1.], [2., -0.1, 2.], [3., 5., 3.], [4., 6., 4.]])
+    assert simplify(points, 0.).tolist() == points.tolist()
+    assert simplify(points, 0.5).tolist() == [[0., 0., 0.], [2., -0.1, 2.], [3., 5., 3.], [4., 6., 4.]]
+    assert simplify(points, 10.).tolist() == [[0., 0., 0.], [4., 6., 4.]]
+    # closed line
+    loop = np.array([[0., 0.], [1., 1.], [0., 0.]])
+    assert len(simplify(loop, 0.5)) == 3
+
+
+def test_route_line():
+    patches = [
+        patch(10., 20., [12., 10.], x=[2., 1.]),
+        patch(0., 10., [0.], x=[0.]),
+    ]
+    assert route_line(patches)[:, 0].tolist() == [0., 1., 2.]
+    assert route_line([]).shape == (0, 3)